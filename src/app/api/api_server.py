@@ -7,14 +7,16 @@ version 0.2.0
 """
 from datetime import datetime, timezone, timedelta
 from fastapi import FastAPI, Header, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional, Union, Annotated
 from pydantic import BaseModel
 from jose import jwt
+import json
 import sys
 
 sys.path.insert(0, "/app")
 
-from src.koios.agent import Workflow, Prompt
+from src.koios.agent import get_workflow, Prompt
 from src.koios.data_store.ChatHistoryStore import ChatHistoryStore
 from src.koios.toon_serializer.ToonSerializer import ToonSerializer
 import src.app.api.models as models
@@ -34,8 +36,47 @@ def _wrap_response(data: Union[BaseModel, dict]):
         return models.EncryptedResponse(encrypted_data=encrypted)
     return data
 
+
+def _decode_query_request(
+    request: Union[models.QueryRequest, models.EncryptedRequest],
+) -> models.QueryRequest:
+    """Helper to decrypt a query request if encryption is enabled."""
+    if config.enable_encryption:
+        if not isinstance(request, models.EncryptedRequest):
+            raise HTTPException(
+                status_code=400,
+                detail="Encrypted request required when ENABLE_ENCRYPTION is True."
+            )
+        try:
+            logger.info(f"Received encrypted data: {request.encrypted_data}")
+            decrypted = Encryption.decrypt(request.encrypted_data)
+            actual_request = models.QueryRequest(**decrypted)
+            logger.info(f"Actual message: {actual_request.query}")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Decryption failed: {e}")
+        return actual_request
+
+    if not isinstance(request, models.QueryRequest):
+        raise HTTPException(
+            status_code=400,
+            detail="Plain request required when ENABLE_ENCRYPTION is False."
+        )
+    return request
+
+
+def _sse_event(data: dict) -> str:
+    """Helper to format (and encrypt, if enabled) a server-sent event."""
+    payload = _wrap_response(data)
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    return f"data: {json.dumps(payload)}\n\n"
+
+
 app = FastAPI(title="Koios RAG API", version="0.2.0")
 
+# Render prompt templates in the background so the first query is not slowed.
+Prompt.start_warmup()
+
 # Single ChatHistoryStore instance shared across all requests (thread-safe via
 # SQLAlchemy's connection pool and per-session context managers).
 _history_store: ChatHistoryStore = ChatHistoryStore(config.chat_history_db_path)
@@ -174,26 +215,7 @@ async def process_query(
     """
     try:
         # 1. Handle decryption if enabled
-        if config.enable_encryption:
-            if not isinstance(request, models.EncryptedRequest):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Encrypted request required when ENABLE_ENCRYPTION is True."
-                )
-            try:
-                logger.info(f"Received encrypted data: {request.encrypted_data}")
-                decrypted = Encryption.decrypt(request.encrypted_data)
-                actual_request = models.QueryRequest(**decrypted)
-                logger.info(f"Actual message: {actual_request.query}")
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Decryption failed: {e}")
-        else:
-            if not isinstance(request, models.QueryRequest):
-                raise HTTPException(
-                    status_code=400,
-                    detail="Plain request required when ENABLE_ENCRYPTION is False."
-                )
-            actual_request = request
+        actual_request = _decode_query_request(request)
 
         # Use provided model or default to first available
         if actual_request.model and actual_request.model != "":
@@ -218,10 +240,10 @@ async def process_query(
         )
 
         # Create workflow and process query.
-        workflow = Workflow(
+        workflow = get_workflow(
             selected_model, actual_request.temperature, enable_internet_search=enable_search
         )
-        output = workflow.local_agent.invoke({
+        output = await workflow.run({
             "question": actual_request.query,
             "history": history_dicts,
             "context": "",
@@ -257,6 +279,79 @@ async def process_query(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# MARK:- Process Query (Streaming)
+@app.post("/query/stream")
+async def process_query_stream(
+    request: Union[models.QueryRequest, models.EncryptedRequest],
+    user_id: str = Depends(Auth.get_current_user),
+):
+    """Process a RAG query and stream the generation as server-sent events.
+
+    Behaves like POST `/query` (history is loaded and the new turn is
+    persisted) but returns a `text/event-stream` response. Each event's
+    `data` is a JSON object — encrypted like other responses when
+    `ENABLE_ENCRYPTION` is True:
+
+    * `{"delta": "..."}` for each chunk of generated text
+    * `{"done": true, "model": "..."}` once generation has finished
+    * `{"error": "..."}` if the workflow fails mid-stream
+
+    The `X-User-ID` header is **required**.
+
+    Args:
+        request: QueryRequest or EncryptedRequest containing query details.
+        user_id: Validated user identifier injected by :func:`Auth.get_current_user`.
+
+    Returns:
+        StreamingResponse: Server-sent event stream of generation deltas.
+    """
+    actual_request = _decode_query_request(request)
+
+    if actual_request.model and actual_request.model != "":
+        selected_model = actual_request.model
+    else:
+        model_options = Prompt.get_available_models()
+        selected_model = model_options[0] if model_options else "llama3.2"
+
+    enable_search = (
+        actual_request.enable_internet_search
+        if actual_request.enable_internet_search is not None
+        else config.enable_internet_search
+    )
+
+    history_dicts = _history_store.get_history(user_id)
+    workflow = get_workflow(
+        selected_model, actual_request.temperature, enable_internet_search=enable_search
+    )
+    state = {
+        "question": actual_request.query,
+        "history": history_dicts,
+        "context": "",
+        "generation": "",
+        "search_query": "",
+    }
+
+    async def event_stream():
+        chunks = []
+        try:
+            async for delta in workflow.stream(state):
+                chunks.append(delta)
+                yield _sse_event({"delta": delta})
+        except Exception as e:
+            logger.error("Streaming query failed for user '%s': %s", user_id, e)
+            yield _sse_event({"error": str(e)})
+            return
+
+        generation = "".join(chunks) or "No generation produced."
+        _history_store.add_messages(user_id, [
+            {"role": "user", "content": actual_request.query},
+            {"role": "assistant", "content": generation},
+        ])
+        yield _sse_event({"done": True, "model": selected_model})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # MARK:- Process Query (Stateless)
 @app.get("/query", response_model=Union[models.QueryResponse, models.EncryptedResponse])
 async def process_query_stateless(
@@ -290,10 +385,10 @@ async def process_query_stateless(
 
         enable_search = config.enable_internet_search
 
-        workflow = Workflow(
+        workflow = get_workflow(
             selected_model, 0.5, enable_internet_search=enable_search
         )
-        output = workflow.local_agent.invoke({
+        output = await workflow.run({
             "question": query,
             "history": [],
             "context": "",
@@ -415,13 +510,13 @@ async def process_analysis(
 
         # Create workflow and process query.
         # We disable internet search for this specialized analysis endpoint.
-        workflow = Workflow(
+        workflow = get_workflow(
             selected_model,
             actual_request.temperature or 0.5,
             enable_internet_search=False
         )
 
-        output = workflow.local_agent.invoke({
+        output = await workflow.run({
             "question": actual_request.prompt,
             "history": [],  # Stateless analysis
             "context": "",
@@ -7,27 +7,160 @@ This file lives at /app/src/app in Docker so that Streamlit adds
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
+import atexit
+import hashlib
+import itertools
 import os
+import threading
+import time
+import uuid
+from datetime import timedelta
 import streamlit
-from src.koios.agent import Workflow, Prompt
-from src.config import config
+from src.koios.agent import get_workflow, Prompt
+from src.config import config, logger
 
 
 @streamlit.cache_resource
 def get_document_store():
     # Lazy load document store
     from src.koios.data_store.DocumentStore import DocumentStore
-    return DocumentStore()
+    return DocumentStore.shared()
+
+
+@streamlit.cache_resource
+def get_history_store():
+    # One store (and connection pool) shared by every session. Per-session
+    # histories are deleted once idle for the retention period; the purge
+    # runs now and on every later `maintenance()`.
+    from src.koios.data_store.ChatHistoryStore import ChatHistoryStore
+    store = ChatHistoryStore(
+        config.chat_history_db_path,
+        expire_prefix=f"{config.streamlit_user_id}:",
+        expire_after=timedelta(hours=config.streamlit_history_retention_hours),
+    )
+    store.maintenance()
+    return store
+
+
+class _HistoryBuffer:
+    """Chat messages waiting to be written to the history store.
+
+    Turns are persisted in groups rather than one commit per turn: a flush
+    happens once `MAX_PENDING` messages are waiting or `FLUSH_INTERVAL`
+    seconds have passed since the last one, and at process exit. Messages
+    are queued per history user id, one per browser session, and stay
+    queued until their write commits, so a failed write is retried on the
+    next flush instead of being lost.
+    """
+
+    MAX_PENDING = 5
+    FLUSH_INTERVAL = 10.0
+
+    def __init__(self, store) -> None:
+        self.__store = store
+        self.__pending: dict[str, list[dict]] = {}
+        self.__last_flush = time.monotonic()
+        self.__lock = threading.Lock()
+        # Held for the whole write so batches commit in the order queued.
+        self.__flush_lock = threading.Lock()
+        atexit.register(self.flush, force=True)
+
+    def add(self, user_id: str, messages: list[dict]) -> None:
+        """Queue *messages* for *user_id* and flush if a threshold is reached."""
+        with self.__lock:
+            self.__pending.setdefault(user_id, []).extend(messages)
+        self.flush()
+
+    def discard(self, user_id: str) -> None:
+        """Drop *user_id*'s queued messages without writing them.
+
+        Waits for an in-flight flush, so a following `clear_history` cannot
+        be overtaken by a late write of the discarded turns.
+        """
+        with self.__flush_lock, self.__lock:
+            self.__pending.pop(user_id, None)
+
+    def flush(self, force: bool = False) -> None:
+        """Write queued messages, one batch per user, if due (or if *force*).
+
+        A non-forced flush returns immediately if another flush is running.
+        """
+        if not self.__flush_lock.acquire(blocking=force):
+            return
+        try:
+            with self.__lock:
+                queued = sum(len(messages) for messages in self.__pending.values())
+                due = (
+                    force
+                    or queued >= self.MAX_PENDING
+                    or time.monotonic() - self.__last_flush >= self.FLUSH_INTERVAL
+                )
+                if not queued or not due:
+                    return
+                self.__last_flush = time.monotonic()
+                batches = [
+                    (user_id, queue, list(queue))
+                    for user_id, queue in self.__pending.items()
+                ]
+            for user_id, queue, batch in batches:
+                try:
+                    self.__store.add_messages(user_id, batch)
+                except Exception as exc:
+                    logger.warning(
+                        "Chat history write for '%s' failed, will retry: %s",
+                        user_id, exc,
+                    )
+                    continue
+                with self.__lock:
+                    # `queue` may have grown meanwhile; drop only what was written.
+                    del queue[:len(batch)]
+                    if not queue and self.__pending.get(user_id) is queue:
+                        del self.__pending[user_id]
+        finally:
+            self.__flush_lock.release()
+
+
+@streamlit.cache_resource
+def get_history_buffer():
+    # Shared across reruns and sessions so pending turns survive a rerun
+    return _HistoryBuffer(get_history_store())
+
+
+@streamlit.cache_data(ttl=300)
+def get_model_options():
+    # Cached across reruns so slider ticks and keystrokes skip the API call
+    return Prompt.get_available_models()
+
+
+@streamlit.cache_data(ttl=60)
+def get_document_names(_doc_store):
+    # Leading underscore keeps Streamlit from hashing the store
+    return _doc_store.get_all_documents()
 
 
 def run_streamlit() -> None:
     """Run the agent workflow and display the output in a Streamlit app."""
+    # Once per process; later reruns return immediately.
+    Prompt.start_warmup()
     # config.setup()
 
     streamlit.set_page_config(page_title="Koios Research Agent", layout="wide")
     streamlit.title("Koios Research Agent")
 
-    # Initialize session state for chat history
+    history_store = get_history_store()
+    history_buffer = get_history_buffer()
+    # Each browser session persists under its own id, so sessions never
+    # share or clear each other's transcripts.
+    if "history_user_id" not in streamlit.session_state:
+        streamlit.session_state.history_user_id = (
+            f"{config.streamlit_user_id}:{uuid.uuid4().hex}"
+        )
+    user_id = streamlit.session_state.history_user_id
+    # Every rerun is a chance to write turns whose interval has elapsed
+    history_buffer.flush()
+
+    # Initialize session state for chat history. The store is write-only
+    # here: a new session starts empty rather than replaying stored turns.
     if "messages" not in streamlit.session_state:
         streamlit.session_state.messages = []
 
@@ -36,7 +169,7 @@ def run_streamlit() -> None:
     
 
     # Fetch models from API via Prompt
-    model_options = Prompt.get_available_models()
+    model_options = get_model_options()
 
     selected_model = streamlit.sidebar.selectbox(
         "Choose the LLM Model",
@@ -70,25 +203,32 @@ def run_streamlit() -> None:
         accept_multiple_files=True
     )
 
+    # Content hashes known to be indexed, so reruns skip the store lookup
+    if "indexed_hashes" not in streamlit.session_state:
+        streamlit.session_state.indexed_hashes = set()
+
     if uploaded_files:
         for uploaded_file in uploaded_files:
-            # Save file temporarily to process it
-            temp_dir = "temp_uploads"
-            os.makedirs(temp_dir, exist_ok=True)
-            file_path = os.path.join(temp_dir, uploaded_file.name)
-
-            # Only process if not already in store (simple check by filename)
-            existing_docs = doc_store.get_all_documents()
-            if uploaded_file.name not in existing_docs:
+            # Deduplicate by content rather than filename
+            file_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+            if file_hash in streamlit.session_state.indexed_hashes:
+                continue
+            if not doc_store.has_file_hash(file_hash):
+                # Save file temporarily to process it
+                temp_dir = "temp_uploads"
+                os.makedirs(temp_dir, exist_ok=True)
+                file_path = os.path.join(temp_dir, uploaded_file.name)
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
 
                 with streamlit.sidebar.spinner(f"Indexing {uploaded_file.name}..."):
-                    doc_store.add_pdf(file_path)
+                    doc_store.add_pdf(file_path, file_hash=file_hash)
+                get_document_names.clear()
                 streamlit.sidebar.success(f"Indexed {uploaded_file.name}")
+            streamlit.session_state.indexed_hashes.add(file_hash)
 
     # Show uploaded documents
-    docs_in_store = doc_store.get_all_documents()
+    docs_in_store = get_document_names(doc_store)
     if docs_in_store:
         streamlit.sidebar.write("Uploaded Documents:")
         for doc_name in docs_in_store:
@@ -99,13 +239,17 @@ def run_streamlit() -> None:
     if streamlit.sidebar.button("Clear Uploaded Documents"):
         doc_store.clear_all_documents()
         get_document_store.clear()
+        get_document_names.clear()
+        streamlit.session_state.indexed_hashes = set()
         streamlit.rerun()
 
     if streamlit.sidebar.button("Clear Chat History"):
+        history_buffer.discard(user_id)
+        history_store.clear_history(user_id)
         streamlit.session_state.messages = []
         streamlit.rerun()
 
-    workflow = Workflow(selected_model, temperature, enable_internet_search=enable_internet_search)
+    workflow = get_workflow(selected_model, temperature, enable_internet_search=enable_internet_search)
 
     # Display chat messages from history on app rerun
     for message in streamlit.session_state.messages:
@@ -129,21 +273,27 @@ def run_streamlit() -> None:
 
         # Display assistant response in chat message container
         with streamlit.chat_message("assistant"):
+            # Invoke agent with question and history, rendering tokens as
+            # they are generated; write_stream returns the full response.
+            deltas = workflow.stream_sync({
+                "question": prompt,
+                "history": history,
+                "context": "",
+                "generation": "",
+                "search_query": ""
+            })
+            # Routing and retrieval run before the first token arrives.
             with streamlit.spinner("Thinking..."):
-                # Invoke agent with question and history
-                output = workflow.local_agent.invoke({
-                    "question": prompt,
-                    "history": history,
-                    "context": "",
-                    "generation": "",
-                    "search_query": ""
-                })
-                response = output["generation"]
-                streamlit.markdown(response)
+                first_delta = next(deltas, "")
+            response = streamlit.write_stream(itertools.chain([first_delta], deltas))
 
         # Add assistant response to chat history
         streamlit.session_state.messages.append({"role": "assistant", "content": response})
 
+        # Queue the user/assistant pair; the buffer writes turns in batches
+        # so most turns cost no commit at all.
+        history_buffer.add(user_id, streamlit.session_state.messages[-2:])
+
 
 if __name__ == "__main__":
     run_streamlit()
@@ -4,10 +4,9 @@ Author: Jared Paubel jpaubel@pm.me
 Version: 0.1.0
 """
 from src.config.config import Config
-from src.config.logger import KoiosLogger
+from src.config.logger import logger
 
-# Shared config and logger singletons
+# Shared config singleton
 config = Config()
-logger = KoiosLogger().logger
 
 __all__ = ["config", "logger"]
@@ -1,4 +1,5 @@
 import os
+from types import MappingProxyType
 from typing import List, Optional
 from dotenv import load_dotenv
 from pathlib import Path
@@ -28,10 +29,25 @@ class Config:
         """Load environment variables from .env file."""
         path: str = Path("./.env")
         load_dotenv(path)
+        # Read-only snapshot of the environment; these values are not expected
+        # to change at runtime, so properties avoid repeated os.getenv calls.
+        self._env: MappingProxyType = MappingProxyType(dict(os.environ))
 
     @property
     def enable_internet_search(self) -> bool:
-        return os.getenv("ENABLE_INTERNET_SEARCH", "False").lower() == "true"
+        return self._env.get("ENABLE_INTERNET_SEARCH", "False").lower() == "true"
+
+    @property
+    def enable_workflow_checkpoints(self) -> bool:
+        """Whether workflow runs checkpoint each step so they can resume.
+
+        Read from the `ENABLE_WORKFLOW_CHECKPOINTS` environment variable.
+        When enabled, a run that fails with a transient connection error is
+        retried once from its last completed node.
+
+        Returns False by default if the variable is not set.
+        """
+        return self._env.get("ENABLE_WORKFLOW_CHECKPOINTS", "False").lower() == "true"
 
     @property
     def chat_history_db_path(self) -> str:
@@ -40,7 +56,7 @@ class Config:
         Defaults to `db/chat_history.sqlite` which is the same directory
         used by ChromaDB so that the existing Docker volume mount covers it.
         """
-        return os.getenv("CHAT_HISTORY_DB_PATH", "db/chat_history.sqlite")
+        return self._env.get("CHAT_HISTORY_DB_PATH", "db/chat_history.sqlite")
 
     @property
     def approved_user_ids(self) -> List[str]:
@@ -54,7 +70,7 @@ class Config:
         Returns an empty list if the variable is not set, which the API server
         treats as *no users approved* (all requests rejected).
         """
-        raw = os.getenv("APPROVED_USER_IDS", "")
+        raw = self._env.get("APPROVED_USER_IDS", "")
         return [uid.strip() for uid in raw.split(",") if uid.strip()]
 
     @property
@@ -65,7 +81,42 @@ class Config:
 
         Returns 500 by default if the variable is not set.
         """
-        return int(os.getenv("MAX_MESSAGES_PER_USER", 500))
+        return int(self._env.get("MAX_MESSAGES_PER_USER", 500))
+
+    @property
+    def streamlit_user_id(self) -> str:
+        """Prefix of the user ids the Streamlit UI stores chat history under.
+
+        Read from the `STREAMLIT_USER_ID` environment variable. Each browser
+        session appends its own random suffix, e.g. `streamlit:<hex>`.
+
+        Returns "streamlit" by default if the variable is not set.
+        """
+        return self._env.get("STREAMLIT_USER_ID", "streamlit")
+
+    @property
+    def streamlit_history_retention_hours(self) -> float:
+        """Idle hours after which a Streamlit session's stored history is deleted.
+
+        Read from the `STREAMLIT_HISTORY_RETENTION_HOURS` environment
+        variable. Each browser session stores its chat under its own id, so
+        without retention those rows would accumulate indefinitely.
+
+        Returns 24 by default if the variable is not set.
+        """
+        return float(self._env.get("STREAMLIT_HISTORY_RETENTION_HOURS", 24))
+
+    @property
+    def toon_min_chars(self) -> int:
+        """Return the compact-JSON size below which context skips TOON.
+
+        Read from the `TOON_MIN_CHARS` environment variable. For short
+        payloads TOON's formatting overhead outweighs its token savings, so
+        they are sent as compact JSON instead. Set to 0 to always use TOON.
+
+        Returns 500 by default if the variable is not set.
+        """
+        return int(self._env.get("TOON_MIN_CHARS", 500))
 
     @property
     def jwt_secret_key(self) -> str:
@@ -75,7 +126,7 @@ class Config:
         value **must** be set; the API server will reject all authenticated
         requests if it is absent.
         """
-        return os.getenv("JWT_SECRET_KEY", "")
+        return self._env.get("JWT_SECRET_KEY", "")
 
     @property
     def jwt_algorithm(self) -> str:
@@ -83,7 +134,7 @@ class Config:
 
         Defaults to `HS256`.  Override via `JWT_ALGORITHM`.
         """
-        return os.getenv("JWT_ALGORITHM", "HS256")
+        return self._env.get("JWT_ALGORITHM", "HS256")
 
     @property
     def jwt_expiry_seconds(self) -> Optional[int]:
@@ -95,7 +146,7 @@ class Config:
 
         Read from `JWT_EXPIRY_SECONDS`.
         """
-        raw = os.getenv("JWT_EXPIRY_SECONDS", "")
+        raw = self._env.get("JWT_EXPIRY_SECONDS", "")
         if raw.strip():
             try:
                 if '*' in raw:
@@ -112,7 +163,7 @@ class Config:
 
         Defaults to `"koios-api"`.  Override via `JWT_ISSUER`.
         """
-        return os.getenv("JWT_ISSUER", "koios-api")
+        return self._env.get("JWT_ISSUER", "koios-api")
 
     @property
     def enable_ip_whitelist(self) -> bool:
@@ -123,7 +174,7 @@ class Config:
         
         Defaults to False. Set ENABLE_IP_WHITELIST=True to enable IP restrictions.
         """
-        return os.getenv("ENABLE_IP_WHITELIST", "False").lower() == "true"
+        return self._env.get("ENABLE_IP_WHITELIST", "False").lower() == "true"
 
     @property
     def authorized_token_ips(self) -> List[str]:
@@ -142,19 +193,19 @@ class Config:
         """
         # Localhost is always allowed for local development.
         localhost = {"127.0.0.1", "::1"}
-        raw = os.getenv("AUTHORIZED_TOKEN_IPS", "")
+        raw = self._env.get("AUTHORIZED_TOKEN_IPS", "")
         configured = {ip.strip() for ip in raw.split(",") if ip.strip()}
         return list(localhost | configured)
 
     @property
     def enable_encryption(self) -> bool:
         """Toggle for payload encryption. Defaults to True."""
-        return os.getenv("ENABLE_ENCRYPTION", "True").lower() == "true"
+        return self._env.get("ENABLE_ENCRYPTION", "True").lower() == "true"
 
     @property
     def encryption_key(self) -> str:
         """Hex-encoded 32-byte key for AES-256-GCM encryption."""
-        return os.getenv("ENCRYPTION_KEY", "")
+        return self._env.get("ENCRYPTION_KEY", "")
 
     @property
     def environment(self) -> str:
@@ -167,4 +218,4 @@ class Config:
         Returns:
             str: Environment name (e.g. "development", "production", "staging").
         """
-        return os.getenv("APP_ENV", "production")
+        return self._env.get("APP_ENV", "production")
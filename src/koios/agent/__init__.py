@@ -4,6 +4,6 @@ Author: Jared Paubel jpaubel@pm.me
 Version: 0.1.0
 """
 from src.koios.agent.prompt import Prompt
-from src.koios.agent.workflow import Workflow
+from src.koios.agent.workflow import Workflow, get_workflow
 
-__all__ = ["Prompt", "Workflow"]
+__all__ = ["Prompt", "Workflow", "get_workflow"]
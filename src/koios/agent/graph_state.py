@@ -18,12 +18,24 @@ class GraphState(TypedDict):
         question (str): The question asked.
         generation (str): LLM generation.
         search_query (str): Revised question for web search.
-        context (str): Web search context result.
+        context (str): Pre-encoded context string; used by generate only when
+            context_obj is empty.
+        context_obj (dict): Native search results keyed by section
+            (`documents`, `results`), encoded once by generate.
         history (List[dict]): Conversation history.
+        question_embedding (List[float]): Embedding of the question, computed
+            once at graph entry.
+        route (str): Router decision made by the prepare node.
+        standalone_question (str): Question reformulated without reference
+            to the chat history, for document search.
     """
     question: str
     generation: str
     search_query: str
     context: str
+    context_obj: dict
     custom_context: str
     history: Annotated[List[dict], operator.add]
+    question_embedding: List[float]
+    route: str
+    standalone_question: str
@@ -5,26 +5,116 @@ Agent prompt class for creating prompt chains to be used in workflow.
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
+import asyncio
 import os
+import threading
 import time
-import requests
+from functools import cached_property
+from typing import Optional
+
+import httpx
+import orjson
+from cachetools import TTLCache
 from langchain.prompts import PromptTemplate
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableLambda, RunnableParallel
+from langchain_core.utils.json import parse_json_markdown
 from langchain_openai import ChatOpenAI
-from langchain_community.tools import WikipediaQueryRun
-from langchain_community.utilities import WikipediaAPIWrapper
 from ddgs import DDGS
 
 from src.koios.enums.Template import Template
 from src.koios.read_template.ReadTemplate import ReadTemplate
 from src.config import logger
 
+# Connection pools shared by every ChatOpenAI client in the process, so the
+# router, query and generate calls to the same backend reuse keep-alive
+# connections instead of each client opening its own pool.
+_HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+HTTP_CLIENT = httpx.Client(timeout=60, limits=_HTTP_LIMITS)
+ASYNC_HTTP_CLIENT = httpx.AsyncClient(timeout=60, limits=_HTTP_LIMITS)
+
+# System prompt that instructs the LLM to reformulate the user's question
+# into a standalone query that can be understood without the chat history.
+_CONTEXTUALIZE_Q_SYSTEM_PROMPT = (
+    "Given a chat history and the latest user question which might reference "
+    "context in the chat history, formulate a standalone question which can be "
+    "understood without the chat history. Do NOT answer the question, just "
+    "reformulate it if needed and otherwise return it as is."
+)
+
+CONTEXTUALIZE_Q_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", _CONTEXTUALIZE_Q_SYSTEM_PROMPT),
+    MessagesPlaceholder(variable_name="chat_history"),
+    ("human", "{input}"),
+])
+
+# Format instructions of a schema-less JsonOutputParser; constant, so they
+# are computed once rather than per chain.
+_JSON_FORMAT_INSTRUCTIONS = JsonOutputParser().get_format_instructions()
+
+
+def _skip_failed_branch(inputs: dict) -> None:
+    """Fallback for a failed `get_prep_chain` branch: log it and yield None."""
+    logger.warning("Preparation chain failed; continuing without it: %s", inputs.get("error"))
+    return None
+
+
+def _parse_json(text: str) -> dict:
+    """Parse a JSON reply from the router or query chain.
+
+    Strips a surrounding Markdown code fence and parses with orjson. Replies
+    with extra prose around the JSON fall back to LangChain's more lenient
+    Markdown-aware parser.
+
+    Args:
+        text (str): Raw model output.
+
+    Returns:
+        dict: Parsed JSON object.
+
+    Raises:
+        OutputParserException: If no JSON can be parsed from *text*.
+    """
+    stripped = text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try:
+        return orjson.loads(stripped)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return parse_json_markdown(text)
+    except ValueError as e:
+        raise OutputParserException(f"Invalid json output: {text}") from e
+
 
 class Prompt:
     """Create prompt chains for invoking agent workflow actions."""
 
-    # Class-level variable to track last DuckDuckGo search time
-    _last_ddg_search_time = 0
+    # Class-level variable to track last DuckDuckGo search time (monotonic)
+    _last_ddg_search_time = float("-inf")
+    # Guards the read-compute-sleep-update of `_last_ddg_search_time`;
+    # created on first use inside the running event loop
+    _ddg_async_lock: Optional[asyncio.Lock] = None
+
+    # Search results keyed by normalised query; failures are kept briefly
+    _search_cache: TTLCache = TTLCache(maxsize=512, ttl=600)
+    _failed_search_cache: TTLCache = TTLCache(maxsize=512, ttl=30)
+    _search_cache_lock = threading.Lock()
+
+    # `/v1/models` response, reused until `_models_deadline` (monotonic) and
+    # revalidated with its ETag afterwards
+    _MODELS_TTL = 30.0
+    _models_cache: Optional[list[str]] = None
+    _models_etag: Optional[str] = None
+    _models_deadline = float("-inf")
+    _models_lock = threading.Lock()
+    # Set while one caller revalidates the list outside `_models_lock`.
+    _models_refreshing = False
+
+    # Whether `start_warmup` has already launched the warm-up thread.
+    _warmup_started = False
+    _warmup_lock = threading.Lock()
 
     def __init__(self, model: str, temperature: float) -> None:
         """Construct AgentPrompt object.
@@ -36,7 +126,27 @@ class Prompt:
         self.__model = model
         self.__temperature = temperature
         self.__read_prompt = ReadTemplate()
-        self.__base_url = os.getenv("OPENAI_URL")
+        self.__base_url = os.getenv("OPENAI_URL", "http://127.0.0.1:1234")
+
+        # One client per temperature, shared by every chain built below.
+        self.__llm = ChatOpenAI(
+            base_url=f"{self.__base_url}/v1",
+            api_key="lm-studio",
+            model=self.__model,
+            temperature=self.__temperature,
+            streaming=True,
+            http_client=HTTP_CLIENT,
+            http_async_client=ASYNC_HTTP_CLIENT,
+        )
+        # Temperature 0 for deterministic routing and query transformation
+        self.__deterministic_llm = ChatOpenAI(
+            base_url=f"{self.__base_url}/v1",
+            api_key="lm-studio",
+            model=self.__model,
+            temperature=0,
+            http_client=HTTP_CLIENT,
+            http_async_client=ASYNC_HTTP_CLIENT,
+        )
 
     @property
     def model(self) -> str:
@@ -47,33 +157,150 @@ class Prompt:
         """
         return self.__model
 
-    @staticmethod
-    def get_available_models() -> list[str]:
+    @property
+    def temperature(self) -> float:
+        """Getter for the generation temperature.
+
+        Returns:
+            float: Model temperature used when generating.
+        """
+        return self.__temperature
+
+    @property
+    def deterministic_llm(self) -> ChatOpenAI:
+        """Getter for the shared temperature-0 chat model.
+
+        Returns:
+            ChatOpenAI: Client used for routing, query rewriting and
+                question reformulation.
+        """
+        return self.__deterministic_llm
+
+    @classmethod
+    def get_available_models(cls) -> list[str]:
         """Fetch available models from the OpenAI-compatible API.
 
+        The list is cached for `_MODELS_TTL` seconds. After that the request
+        carries `If-None-Match`, and a 304 reply keeps the cached list. The
+        request runs outside `_models_lock`: while one caller revalidates,
+        others are served the stale list instead of waiting on the network.
+
         Returns:
-            list[str]: List of model IDs that are currently loaded on the server.
+            list[str]: List of model IDs that are currently loaded on the
+                server (a copy; mutating it does not affect the cache).
         """
+        with cls._models_lock:
+            if cls._models_cache is not None and (
+                time.monotonic() < cls._models_deadline or cls._models_refreshing
+            ):
+                return list(cls._models_cache)
+            cls._models_refreshing = True
+            etag = cls._models_etag if cls._models_cache is not None else None
+
+        models: Optional[list[str]] = None
+        new_etag: Optional[str] = None
+        not_modified = False
         try:
             # Use the configured OPENAI_URL; fall back to default if not set.
             base_url = os.getenv('OPENAI_URL')
             if not base_url:
                 base_url = 'http://127.0.0.1:1234'   # default local server
-            response = requests.get(f"{base_url}/v1/models", timeout=2)
-            if response.status_code == 200:
+            headers = {"If-None-Match": etag} if etag else {}
+            response = HTTP_CLIENT.get(f"{base_url}/v1/models", headers=headers, timeout=2)
+            if response.status_code == 304:
+                not_modified = True
+            elif response.status_code == 200:
                 # OpenAI-compatible API returns a list of model objects with an 'id' field
-                return [model["id"] for model in response.json().get("data", [])]
+                models = [model["id"] for model in response.json().get("data", [])]
+                new_etag = response.headers.get("ETag")
         except Exception:
             pass
-        return ["llama3.2"]
 
-    def web_search_with_fallback(self, query: str) -> str:
+        with cls._models_lock:
+            cls._models_refreshing = False
+            if models is not None:
+                cls._models_cache = models
+                cls._models_etag = new_etag
+                cls._models_deadline = time.monotonic() + cls._MODELS_TTL
+            elif not_modified and cls._models_cache is not None:
+                cls._models_deadline = time.monotonic() + cls._MODELS_TTL
+            # Prefer a stale list over the placeholder if the server hiccups.
+            return list(cls._models_cache or ["llama3.2"])
+
+    @classmethod
+    def warm(cls, models: Optional[list[str]] = None) -> None:
+        """Render every prompt template ahead of the first request.
+
+        Loads the tokenizer for each model and caches the rendered chat
+        prompt for each template, so the first `Prompt` for any of these
+        models builds its chains without downloads or Jinja2 renders.
+
+        If *models* is not given and the backend's model list cannot be
+        fetched, nothing is warmed: the placeholder model name returned in
+        that case may not be served and could trigger a needless tokenizer
+        download.
+
+        Args:
+            models (Optional[list[str]]): Models to warm. Defaults to the
+                models currently served by the backend.
+        """
+        if not models:
+            models = cls.get_available_models()
+            if not cls._models_cache:
+                logger.info("Model list unavailable; skipping prompt template warm-up")
+                return
+        read_prompt = ReadTemplate()
+        for model in models:
+            try:
+                for template in Template:
+                    read_prompt.get_chat_prompt(model, template)
+            except Exception as e:
+                logger.warning("Failed to warm prompt templates for model '%s': %s", model, e)
+                continue
+            logger.info("Prompt templates warmed for model '%s'", model)
+
+    @classmethod
+    def start_warmup(cls) -> None:
+        """Run `warm` once per process in a background daemon thread.
+
+        Called by the app entry points (API server, Streamlit) so the first
+        user question does not wait for tokenizers and template renders,
+        without importing the package triggering network calls.
+        """
+        with cls._warmup_lock:
+            if cls._warmup_started:
+                return
+            cls._warmup_started = True
+        threading.Thread(target=cls.warm, name="koios-prompt-warmup", daemon=True).start()
+
+    def preinitialize(self) -> None:
+        """Warm the prompt chains ahead of the first request.
+
+        Touching each chain property builds and caches it, forcing the
+        template read, the tokenizer download and the chat-template render so
+        that the first user query does not pay for them serially.
+        """
+        try:
+            self.get_generate_chain
+            self.get_router_chain
+            self.get_query_chain
+            logger.info("Prompt chains warmed for model '%s'", self.__model)
+        except Exception as e:
+            logger.warning("Failed to warm prompt chains for model '%s': %s", self.__model, e)
+
+    async def web_search_with_fallback_async(self, query: str) -> str:
         """Perform web search with fallback to Wikipedia on rate limit.
 
         Results from DuckDuckGo are encoded as TOON before being returned so
         that the downstream generate prompt receives a token-efficient
         representation of the search context.
 
+        This is the only DuckDuckGo entry point, so one limiter enforces the
+        one-second spacing. The wait is awaited with `asyncio.sleep` under an
+        `asyncio.Lock`, so a throttled search yields the event loop to other
+        in-flight workflows instead of blocking a thread. The blocking search
+        clients run in worker threads.
+
         Args:
             query (str): The search query.
 
@@ -81,35 +308,93 @@ class Prompt:
             str: TOON-encoded search results, or a Wikipedia summary string
                 on fallback.
         """
+        key = self.__search_cache_key(query)
+        cached = self.__get_cached_search(key)
+        if cached is not None:
+            logger.info("Step: Using cached search results")
+            return cached
+
+        if Prompt._ddg_async_lock is None:
+            Prompt._ddg_async_lock = asyncio.Lock()
+
         try:
-            # Enforce rate limit: DuckDuckGo allows 1 request per second
-            current_time = time.time()
-            time_since_last_search = current_time - Prompt._last_ddg_search_time
-
-            if time_since_last_search < 1.0:
-                # Wait for the remaining time to respect the 1-second rate limit
-                sleep_time = 1.0 - time_since_last_search
-                logger.info(f"Rate limiting: waiting {sleep_time:.2f}s before DuckDuckGo search...")
-                time.sleep(sleep_time)
-
-            # Update the last search time
-            Prompt._last_ddg_search_time = time.time()
-
-            with DDGS() as ddgs:
-                results = ddgs.text(query, safesearch="moderate", max_results=3, page=1)
-                logger.debug("DuckDuckGo results: %s", results)
+            async with Prompt._ddg_async_lock:
+                sleep_time = self.__rate_limit_delay()
+                if sleep_time > 0:
+                    logger.debug("Rate limiting: waiting %.2fs before DuckDuckGo search", sleep_time)
+                    await asyncio.sleep(sleep_time)
+                Prompt._last_ddg_search_time = time.monotonic()
+
+            results = await asyncio.to_thread(self.__ddg_text, query)
+            with Prompt._search_cache_lock:
+                Prompt._search_cache[key] = results
             return results
 
         except Exception as e:
-            logger.warning(f"DuckDuckGo search failed or rate limited: {e}")
-            logger.info("Falling back to Wikipedia...")
-            try:
-                wiki = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
-                return wiki.invoke(query)
-            except Exception as wiki_e:
-                return f"Search failed: {e}. Fallback failed: {wiki_e}"
+            return await asyncio.to_thread(self.__wikipedia_fallback, key, query, e)
 
-    @property
+    @staticmethod
+    def __search_cache_key(query: str) -> str:
+        """Normalise *query* so identical searches share a cache entry.
+
+        Identical queries (modulo case and whitespace) within the TTL are
+        served from memory, skipping both the network and the rate limit.
+        """
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def __get_cached_search(key: str) -> Optional[str]:
+        """Return a cached search or fallback result for *key*, if any."""
+        with Prompt._search_cache_lock:
+            cached = Prompt._search_cache.get(key)
+            if cached is None:
+                cached = Prompt._failed_search_cache.get(key)
+        return cached
+
+    @staticmethod
+    def __rate_limit_delay() -> float:
+        """Return how long to wait before the next DuckDuckGo request."""
+        return 1.0 - (time.monotonic() - Prompt._last_ddg_search_time)
+
+    @staticmethod
+    def __ddg_text(query: str):
+        """Run the DuckDuckGo text search for *query*."""
+        with DDGS() as ddgs:
+            results = ddgs.text(query, safesearch="moderate", max_results=3, page=1)
+            logger.debug("DuckDuckGo result size=%d", len(results) if results else 0)
+        return results
+
+    @staticmethod
+    def __wikipedia_fallback(key: str, query: str, error: Exception) -> str:
+        """Search Wikipedia after a failed DuckDuckGo search.
+
+        Args:
+            key (str): Normalised cache key for *query*.
+            query (str): The search query.
+            error (Exception): The DuckDuckGo failure.
+
+        Returns:
+            str: Wikipedia summary, or an error description.
+        """
+        logger.warning("DuckDuckGo search failed or rate limited: %s", error)
+        logger.info("Falling back to Wikipedia...")
+        try:
+            # Deferred: langchain_community pulls in many transitive
+            # modules and is only needed on this fallback path.
+            from langchain_community.tools import WikipediaQueryRun
+            from langchain_community.utilities import WikipediaAPIWrapper
+
+            wiki = WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper())
+            result = wiki.invoke(query)
+        except Exception as wiki_e:
+            result = f"Search failed: {error}. Fallback failed: {wiki_e}"
+        # Negative-cache the fallback briefly so a throttled DuckDuckGo is
+        # not hammered again for the same query.
+        with Prompt._search_cache_lock:
+            Prompt._failed_search_cache[key] = result
+        return result
+
+    @cached_property
     def get_generate_chain(self) -> str:
         """Generation stage of agent.
 
@@ -135,17 +420,11 @@ class Prompt:
 
         # Chain (pipes between each operation)
         # StrOutputParser ensures result is in plain-text
-        llm = ChatOpenAI(
-            base_url=f"{self.__base_url}/v1",
-            api_key="lm-studio",
-            model=self.__model,
-            temperature=self.__temperature
-        )
-        generate_chain = generate_prompt | llm | StrOutputParser()
+        generate_chain = generate_prompt | self.__llm | StrOutputParser()
 
         return generate_chain
 
-    @property
+    @cached_property
     def get_router_chain(self) -> str:
         """Calls `__prompt_using_json` using default template (router).
 
@@ -154,7 +433,7 @@ class Prompt:
         """
         return self.__prompt_using_json()
 
-    @property
+    @cached_property
     def get_query_chain(self):
         """Calls `__prompt_using_json` using query template.
 
@@ -163,6 +442,56 @@ class Prompt:
         """
         return self.__prompt_using_json(Template.QUERY)
 
+    @cached_property
+    def get_contextualize_chain(self):
+        """Chain rewriting a follow-up question into a standalone question.
+
+        Expects `input` (the question) and `chat_history` (LangChain
+        messages).
+
+        Returns:
+            str: String chain of prompt template processed by LLM.
+        """
+        return CONTEXTUALIZE_Q_PROMPT | self.__deterministic_llm | StrOutputParser()
+
+    def get_prep_chain(
+        self, route: bool = True, query: bool = True, standalone: bool = True
+    ) -> RunnableParallel:
+        """Run the selected preparation chains as one concurrent step.
+
+        Routing, web-query rewriting and standalone-question reformulation
+        are independent temperature-0 calls on the same model, so they are
+        issued together instead of one after another. Branches whose answer
+        is already known can be left out.
+
+        The input must provide `question`, `input` (the same question) and
+        `chat_history`; the output has one key per selected branch. A branch
+        that fails (e.g. unparsable JSON) yields None instead of aborting
+        the others.
+
+        Args:
+            route (bool): Include the router chain as `route`.
+            query (bool): Include the web-query chain as `query`.
+            standalone (bool): Include the contextualize chain as
+                `standalone`.
+
+        Returns:
+            RunnableParallel: Parallel runnable over the selected chains.
+        """
+        chains = {}
+        if route:
+            chains["route"] = self.get_router_chain
+        if query:
+            chains["query"] = self.get_query_chain
+        if standalone:
+            chains["standalone"] = self.get_contextualize_chain
+        return RunnableParallel({
+            name: chain.with_fallbacks(
+                [RunnableLambda(_skip_failed_branch)], exception_key="error"
+            )
+            for name, chain in chains.items()
+        })
+
     def __prompt_using_json(self, template: Template = Template.ROUTER) -> str:
         """Generation stage of agent.
 
@@ -175,7 +504,7 @@ class Prompt:
         loaded model so that the correct special tokens are injected
         automatically — no post-processing cleanup is required.
 
-        `JsonOutputParser.get_format_instructions()` is injected into the
+        The schema-less `JsonOutputParser` format instructions are injected into the
         prompt as `{format_instructions}` so the model receives an explicit
         schema contract.  Templates that do not contain the placeholder (e.g.
         the query template) simply omit the variable from `input_variables`
@@ -195,8 +524,6 @@ class Prompt:
             template,
         )
 
-        parser = JsonOutputParser()
-
         # Inject format instructions only when the template contains the
         # {format_instructions} placeholder so the model knows the exact
         # JSON schema it must produce.
@@ -204,7 +531,7 @@ class Prompt:
             prompt = PromptTemplate(
                 template=formatted_template,
                 input_variables=["question"],
-                partial_variables={"format_instructions": parser.get_format_instructions()},
+                partial_variables={"format_instructions": _JSON_FORMAT_INSTRUCTIONS},
             )
         else:
             prompt = PromptTemplate(
@@ -212,13 +539,5 @@ class Prompt:
                 input_variables=["question"],
             )
 
-        # Use temperature 0 for deterministic routing and query transformation
-        llm = ChatOpenAI(
-            base_url=f"{self.__base_url}/v1",
-            api_key="lm-studio",
-            model=self.__model,
-            temperature=0
-        )
-
-        chain = prompt | llm | StrOutputParser() | parser
+        chain = prompt | self.__deterministic_llm | StrOutputParser() | RunnableLambda(_parse_json)
         return chain
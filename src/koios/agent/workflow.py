@@ -5,21 +5,74 @@ determines whether the question requires consulting the local document store or
 can be answered directly from the model's internal knowledge.
 
 Path:
-  Router
-    ├── doc_search → [if empty & internet enabled] web_search → generate
-    │             → [if empty & internet disabled] generate
-    │             → [if docs found] generate
-    ├── web_search → web_search → generate
+  embed_question → prepare (whichever of route, web query and standalone
+                            question are still needed, in at most one
+                            concurrent LLM round-trip) → Router
+    ├── doc_search → [internet enabled] speculative_search → generate
+    │                  (web_search runs alongside; kept only if no docs found)
+    │             → [internet disabled] doc_search → generate
+    ├── web_search → parallel_search (doc_search ∥ web_search) → generate
     └── generate
 
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
+import asyncio
+import functools
+import threading
+import uuid
+from typing import AsyncIterator, Iterator, Optional
+
+import httpx
+import openai
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import END, StateGraph
 
 from src.koios.agent.graph_state import GraphState
 from src.koios.agent.workflow_actions import WorkflowActions
 from src.koios.agent.prompt import Prompt
+from src.config import config, logger
+
+# Event loop shared by synchronous callers (CLI, Streamlit). Reusing one
+# long-lived loop lets async HTTP clients keep their connections between
+# calls instead of binding to a fresh `asyncio.run` loop every time.
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared background event loop, starting it on first use."""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, daemon=True).start()
+    return _background_loop
+
+
+# Failures worth resuming a checkpointed run for: the model server or a
+# search backend was briefly unreachable. Anything else (bad input, parser
+# errors) would fail the same way again.
+_TRANSIENT_ERRORS = (httpx.TransportError, openai.APIConnectionError)
+
+
+class _RunCheckpointer(MemorySaver):
+    """In-memory checkpointer whose per-run threads can be deleted.
+
+    `delete_thread` is part of the public saver API in later
+    langgraph-checkpoint releases; the pinned 1.0 `MemorySaver` lacks it, so
+    it is provided here until the dependency is upgraded.
+    """
+
+    def delete_thread(self, thread_id: str) -> None:
+        """Drop every checkpoint and pending write stored for *thread_id*."""
+        delete = getattr(super(), "delete_thread", None)
+        if delete is not None:
+            delete(thread_id)
+            return
+        self.storage.pop(thread_id, None)
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            del self.writes[key]
 
 
 class Workflow:
@@ -36,16 +89,29 @@ class Workflow:
         agent_prompt: Prompt = Prompt(model, temperature)
         actions = WorkflowActions(agent_prompt, enable_internet_search)
 
+        # Warm the prompt chains in the background so the first request finds
+        # the templates and tokenizer ready without blocking construction.
+        threading.Thread(target=agent_prompt.preinitialize, daemon=True).start()
+
         workflow = StateGraph(GraphState)
+        workflow.add_node("embed_question", actions.embed_question)
+        workflow.add_node("prepare", actions.prepare)
         workflow.add_node("web_search", actions.web_search)
         workflow.add_node("doc_search", actions.doc_search)
+        workflow.add_node("parallel_search", actions.parallel_search)
+        workflow.add_node("speculative_search", actions.speculative_search)
         workflow.add_node("generate", actions.generate)
 
-        workflow.set_conditional_entry_point(
+        workflow.set_entry_point("embed_question")
+        workflow.add_edge("embed_question", "prepare")
+        workflow.add_conditional_edges(
+            "prepare",
             actions.route_question,
             {
-                "doc_search": "doc_search",
-                "web_search": "web_search",
+                # With internet search available, start the web search
+                # alongside the document search instead of after it.
+                "doc_search": "speculative_search" if enable_internet_search else "doc_search",
+                "web_search": "parallel_search",
                 "generate": "generate",
             },
         )
@@ -60,8 +126,18 @@ class Workflow:
         )
 
         workflow.add_edge("web_search", "generate")
+        workflow.add_edge("parallel_search", "generate")
+        workflow.add_edge("speculative_search", "generate")
         workflow.add_edge("generate", END)
-        self.__local_agent = workflow.compile()
+        # Opt-in: each run gets its own checkpoint thread, so a run that hits
+        # a transient error can resume from the last completed node instead
+        # of re-embedding and re-routing. Threads are deleted when the run
+        # finishes, which keeps the compiled graph safe to share between
+        # requests. Without it, no state is saved per superstep.
+        self.__checkpointer: Optional[_RunCheckpointer] = (
+            _RunCheckpointer() if config.enable_workflow_checkpoints else None
+        )
+        self.__local_agent = workflow.compile(checkpointer=self.__checkpointer)
 
     @property
     def local_agent(self) -> StateGraph:
@@ -71,3 +147,131 @@ class Workflow:
             StateGraph: Agent state graph object.
         """
         return self.__local_agent
+
+    def __new_run_config(self) -> Optional[dict]:
+        """Return a run config with a fresh checkpoint thread id, if enabled."""
+        if self.__checkpointer is None:
+            return None
+        return {"configurable": {"thread_id": uuid.uuid4().hex}}
+
+    def __discard_thread(self, run_config: Optional[dict]) -> None:
+        """Delete the checkpoint thread of a finished run."""
+        if run_config is not None:
+            self.__checkpointer.delete_thread(run_config["configurable"]["thread_id"])
+
+    async def run(self, state: dict) -> dict:
+        """Run the workflow on the current event loop.
+
+        With workflow checkpoints enabled, a run that fails with a transient
+        connection error is retried once from its last checkpoint, so nodes
+        that already completed are not executed again.
+
+        Args:
+            state (dict): Initial graph state.
+
+        Returns:
+            dict: Final graph state.
+        """
+        run_config = self.__new_run_config()
+        if run_config is None:
+            return await self.__local_agent.ainvoke(state)
+        try:
+            try:
+                return await self.__local_agent.ainvoke(state, run_config)
+            except _TRANSIENT_ERRORS as e:
+                logger.warning("Workflow run failed (%s); resuming from last checkpoint", e)
+                return await self.__local_agent.ainvoke(None, run_config)
+        finally:
+            self.__discard_thread(run_config)
+
+    async def stream(self, state: dict) -> AsyncIterator[str]:
+        """Run the workflow and yield the generation as it is produced.
+
+        Token deltas from the generate node's chat model are forwarded as
+        soon as they arrive. If the generate node produced its answer without
+        streaming (e.g. a cache hit), the full generation is yielded once.
+
+        Args:
+            state (dict): Initial graph state.
+
+        Yields:
+            str: Generation text deltas.
+        """
+        streamed = False
+        run_config = self.__new_run_config()
+        try:
+            async for event in self.__local_agent.astream_events(
+                state, run_config, version="v2"
+            ):
+                if event["metadata"].get("langgraph_node") != "generate":
+                    continue
+                if event["event"] == "on_chat_model_stream":
+                    delta = event["data"]["chunk"].content
+                    if delta:
+                        streamed = True
+                        yield delta
+                elif event["event"] == "on_chain_end" and event["name"] == "generate":
+                    output = event["data"].get("output") or {}
+                    if not streamed and output.get("generation"):
+                        yield output["generation"]
+        finally:
+            self.__discard_thread(run_config)
+
+    def run_sync(self, state: dict) -> dict:
+        """Run the workflow from synchronous code.
+
+        The coroutine is scheduled on a shared background event loop and
+        this call blocks until it completes.
+
+        Args:
+            state (dict): Initial graph state.
+
+        Returns:
+            dict: Final graph state.
+        """
+        future = asyncio.run_coroutine_threadsafe(self.run(state), _get_background_loop())
+        return future.result()
+
+    def stream_sync(self, state: dict) -> Iterator[str]:
+        """Stream the generation from synchronous code.
+
+        Each delta of `stream` is pulled through the shared background event
+        loop, so callers such as Streamlit can render tokens as they arrive.
+
+        Args:
+            state (dict): Initial graph state.
+
+        Yields:
+            str: Generation text deltas.
+        """
+        loop = _get_background_loop()
+        deltas = self.stream(state)
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(deltas.__anext__(), loop)
+                try:
+                    yield future.result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(deltas.aclose(), loop).result()
+
+
+@functools.lru_cache(maxsize=8)
+def get_workflow(model: str, temperature: float, enable_internet_search: bool = False) -> Workflow:
+    """Return a compiled workflow, building it only once per configuration.
+
+    Building a `Workflow` compiles the state graph and constructs the
+    prompt and retriever; caching it means requests with the same settings
+    reuse one instance. All configurations share the process-wide
+    `DocumentStore`, so the embedding model is loaded only once.
+
+    Args:
+        model (str): Selected model to load.
+        temperature (float): Model temperature to use when generating.
+        enable_internet_search (bool): Whether to allow web search.
+
+    Returns:
+        Workflow: Shared workflow for this configuration.
+    """
+    return Workflow(model, temperature, enable_internet_search=enable_internet_search)
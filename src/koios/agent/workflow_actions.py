@@ -5,36 +5,55 @@ Workflow actions class containing actions for agent to take.
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
-import os
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from functools import cached_property
 from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import create_history_aware_retriever
-from langchain_openai import ChatOpenAI
 
-from src.koios.agent.prompt import Prompt
+from src.koios.agent.prompt import CONTEXTUALIZE_Q_PROMPT, Prompt
 from src.koios.data_store.DocumentStore import DocumentStore
+from src.koios.semantic_cache.SemanticCache import SemanticCache
 from src.koios.toon_serializer.ToonSerializer import ToonSerializer
-from src.config import logger
-
-# System prompt that instructs the LLM to reformulate the user's question
-# into a standalone query that can be understood without the chat history.
-_CONTEXTUALIZE_Q_SYSTEM_PROMPT = (
-    "Given a chat history and the latest user question which might reference "
-    "context in the chat history, formulate a standalone question which can be "
-    "understood without the chat history. Do NOT answer the question, just "
-    "reformulate it if needed and otherwise return it as is."
+from src.config import config, logger
+
+# Keyword pre-filter for questions whose route is obvious. A question that
+# matches exactly one pattern skips the router LLM call; anything else
+# (no match, or both) falls through to the router chain.
+_WEB_ROUTE_RE = re.compile(
+    r"\b(latest|news|today|current(ly)?|price of|weather|search the web|online)\b",
+    re.IGNORECASE,
+)
+_DOC_ROUTE_RE = re.compile(
+    r"\b(documents?|pdfs?|reports?|sections?|chapters?|uploaded|attached)\b",
+    re.IGNORECASE,
 )
-
-_CONTEXTUALIZE_Q_PROMPT = ChatPromptTemplate.from_messages([
-    ("system", _CONTEXTUALIZE_Q_SYSTEM_PROMPT),
-    MessagesPlaceholder(variable_name="chat_history"),
-    ("human", "{input}"),
-])
 
 
 class WorkflowActions:
     """Provide workflow actions for agent to take."""
 
+    # Shared across workflow instances. Paraphrased questions from any
+    # session skip the router call; generations are only reused for exact
+    # (normalised) repeats, since `generate` keys them on the question text.
+    _route_cache = SemanticCache(threshold=0.92)
+    _generation_cache = SemanticCache(threshold=0.92)
+
+    # doc_search records keyed by model, document-store version, question
+    # and history. Cached lists are shared and must not be mutated.
+    _RETRIEVAL_CACHE_MAXSIZE = 64
+    _retrieval_cache: OrderedDict[bytes, list[dict]] = OrderedDict()
+    _retrieval_cache_lock = threading.Lock()
+
+    # LangChain message class for each history role; other roles are dropped.
+    _ROLE_CLS: dict[str, type[BaseMessage]] = {
+        "user": HumanMessage,
+        "assistant": AIMessage,
+    }
+
     def __init__(self, agent_prompt: Prompt, enable_internet_search: bool = False):
         """Construct WorkflowActions object.
 
@@ -45,25 +64,49 @@ class WorkflowActions:
         """
         self.__agent_prompt = agent_prompt
         self.__enable_internet_search = enable_internet_search
-        self.__doc_store = DocumentStore()
-
-        # Build the history-aware retriever once at construction time.
-        # It uses a small, fast LLM to reformulate the user's question into a
-        # standalone query before hitting the vector store.
-        base_url = os.getenv("OPENAI_URL", "http://127.0.0.1:1234")
-        _llm = ChatOpenAI(
-            base_url=f"{base_url}/v1",
-            api_key="lm-studio",
-            model=agent_prompt.model,
-            temperature=0,
-        )
-        self.__history_aware_retriever = create_history_aware_retriever(
-            llm=_llm,
+        self.__doc_store = DocumentStore.shared()
+        # (history list, its length, converted messages) of the last call
+        self.__last_history: tuple[list, int, list[BaseMessage]] | None = None
+
+    @cached_property
+    def __history_aware_retriever(self):
+        """History-aware retriever, built on first use by `doc_search`.
+
+        It reuses the prompt's temperature-0 client to reformulate the user's
+        question into a standalone query before hitting the vector store.
+        Building it opens the vector store and loads the embedding model, so
+        it is deferred rather than done at construction.
+        """
+        return create_history_aware_retriever(
+            llm=self.__agent_prompt.deterministic_llm,
             retriever=self.__doc_store.get_retriever(),
-            prompt=_CONTEXTUALIZE_Q_PROMPT,
+            prompt=CONTEXTUALIZE_Q_PROMPT,
         )
 
-    def generate(self, state: dict) -> dict:
+    async def embed_question(self, state: dict) -> dict:
+        """Embed the question once for reuse by every downstream node.
+
+        The router cache, the generation cache and document search all match
+        on the same vector, so computing it at graph entry saves repeated
+        encoder passes.
+
+        Args:
+            state (dict): The current graph state.
+
+        Returns:
+            state (dict): New key added to state, question_embedding.
+        """
+        embedding = await asyncio.to_thread(self.__doc_store.embed_query, state["question"])
+        return {"question_embedding": embedding}
+
+    async def __get_question_embedding(self, state: dict) -> list[float]:
+        """Return the question embedding from state, computing it if absent."""
+        embedding = state.get("question_embedding")
+        if not embedding:
+            embedding = (await self.embed_question(state))["question_embedding"]
+        return embedding
+
+    async def generate(self, state: dict) -> dict:
         """Generate answer based on existing knowledge.
 
         Args:
@@ -77,8 +120,17 @@ class WorkflowActions:
         question = state["question"]
         history = state.get("history", [])
 
+        # Search nodes leave native records in `context_obj`; they are
+        # encoded once here. A pre-encoded `context` string is still honoured.
+        context_obj = state.get("context_obj") or {}
+        if context_obj:
+            retrieved_context = ToonSerializer.dumps(
+                context_obj, min_chars=config.toon_min_chars
+            )
+        else:
+            retrieved_context = state.get("context") or ""
+
         # Merge retrieved context with any custom payload injected via the API.
-        retrieved_context = state.get("context") or ""
         custom_context = state.get("custom_context") or ""
 
         if retrieved_context and custom_context:
@@ -94,34 +146,66 @@ class WorkflowActions:
             logger.info(f'  Sub-Step: No additional context providing. Using internal knowledge')
             context = "No additional context provided. Answer based on your internal knowledge."
 
+        # Generations are only reused for the same model, context, history
+        # and (normalised) question text, so a merely similar question never
+        # receives another question's answer. Sampled (temperature > 0)
+        # completions are not cached at all.
+        use_cache = self.__agent_prompt.temperature == 0
+        if use_cache:
+            cache_key = hashlib.blake2b(
+                repr((
+                    self.__agent_prompt.model,
+                    " ".join(question.casefold().split()),
+                    context,
+                    [(m.get("role"), m.get("content")) for m in history],
+                )).encode("utf-8")
+            ).hexdigest()
+            question_embedding = await self.__get_question_embedding(state)
+            cached = WorkflowActions._generation_cache.get(question_embedding, key=cache_key)
+            if cached is not None:
+                logger.info("  Sub-Step: Using cached generation for a repeated question")
+                return {"generation": cached}
+
         results = {"context": context, "question": question, "history": history}
-        generation = self.__agent_prompt.get_generate_chain.invoke(results)
+        # Stream the completion so token events reach `Workflow.stream`
+        # consumers as they are produced; the node still returns the full text.
+        chunks = []
+        async for chunk in self.__agent_prompt.get_generate_chain.astream(results):
+            chunks.append(chunk)
+        generation = "".join(chunks)
+        if use_cache:
+            WorkflowActions._generation_cache.put(question_embedding, generation, key=cache_key)
         return {"generation": generation}
 
-    def web_search(self, state: dict) -> dict:
+    async def web_search(self, state: dict) -> dict:
         """Optimize the user query and perform a web search.
 
         The raw question is first transformed into an optimized search query
-        via the query chain, then the search is executed against the web.
+        via the query chain (unless `prepare` already did so), then the
+        search is executed against the web.
 
         Args:
             state (dict): The current graph state.
 
         Returns:
-            state (dict): Appended web results to context.
+            state (dict): Web results under `results` in context_obj.
         """
         question = state['question']
-        logger.info("Step: Optimizing Query for Web Search")
-        gen_query = self.__agent_prompt.get_query_chain.invoke(
-            {"question": question}
-        )
-        search_query = gen_query["query"]
+        search_query = state.get("search_query")
+        if not search_query:
+            logger.info("Step: Optimizing Query for Web Search")
+            gen_query = await self.__agent_prompt.get_query_chain.ainvoke(
+                {"question": question}
+            )
+            search_query = gen_query["query"]
         logger.info(f'Step: Searching the Web for: "{search_query}"')
-        search_result = self.__agent_prompt.web_search_with_fallback(
+        # The rate-limit wait is awaited and the search client runs in a
+        # worker thread, so other in-flight workflows keep making progress.
+        search_result = await self.__agent_prompt.web_search_with_fallback_async(
             search_query
         )
-        # Encode the list of {"title", "href", "body"} dicts as TOON.
-        return {"context": ToonSerializer.dumps({"results": search_result})}
+        # The list of {"title", "href", "body"} dicts is encoded by generate.
+        return {"context_obj": {"results": search_result}}
 
     @staticmethod
     def _to_langchain_messages(history: list) -> list[BaseMessage]:
@@ -137,56 +221,186 @@ class WorkflowActions:
         Returns:
             list[BaseMessage]: Equivalent LangChain message objects.
         """
-        messages: list[BaseMessage] = []
-        for msg in history:
-            role = msg.get("role", "")
-            content = msg.get("content", "")
-            if role == "user":
-                messages.append(HumanMessage(content=content))
-            elif role == "assistant":
-                messages.append(AIMessage(content=content))
+        return [
+            cls(content=msg.get("content", ""))
+            for msg in history
+            if (cls := WorkflowActions._ROLE_CLS.get(msg.get("role")))
+        ]
+
+    def __history_messages(self, history: list) -> list[BaseMessage]:
+        """Return `_to_langchain_messages(history)`, reusing the last result.
+
+        `prepare` and `doc_search` convert the same history list during one
+        run. The cached list object is held, so identity plus length is a
+        reliable key for an append-only history.
+
+        Args:
+            history (list): List of `{"role", "content"}` dicts.
+
+        Returns:
+            list[BaseMessage]: Equivalent LangChain message objects.
+        """
+        cached = self.__last_history
+        if cached is not None and cached[0] is history and cached[1] == len(history):
+            return cached[2]
+        messages = self._to_langchain_messages(history)
+        self.__last_history = (history, len(history), messages)
         return messages
 
-    def doc_search(self, state: dict) -> dict:
+    async def doc_search(self, state: dict) -> dict:
         """Search document store based on the question using history-aware retrieval.
 
         The history-aware retriever first reformulates the user's question into
         a standalone query (using the chat history for context) and then
         performs similarity search against the vector store.  Retrieved
-        documents are encoded as TOON before being stored in the graph state
-        so that the downstream generate prompt receives a token-efficient
-        representation of the document context.
+        documents are stored in the graph state as plain records; generate
+        encodes them (as TOON) once when building the prompt.
 
         Args:
             state (dict): The current graph state.
 
         Returns:
-            state (dict): Appended document results to context.
+            state (dict): Document records under `documents` in context_obj,
+                or an empty context_obj when nothing matched.
         """
         question = state["question"]
         raw_history = state.get("history", [])
-        chat_history = self._to_langchain_messages(raw_history)
+        chat_history = self.__history_messages(raw_history)
 
         logger.info(f'Step: Searching Document Store for: "{question}"')
+        # Reformulation (temperature 0) and retrieval are deterministic for a
+        # given question, history and document set, so the records are
+        # reused until the store changes.
+        cache_key = hashlib.blake2b(
+            repr((
+                self.__agent_prompt.model,
+                DocumentStore.version(),
+                question,
+                [(m.get("role"), m.get("content")) for m in raw_history],
+            )).encode("utf-8")
+        ).digest()
+        with WorkflowActions._retrieval_cache_lock:
+            cached = WorkflowActions._retrieval_cache.get(cache_key)
+            if cached is not None:
+                WorkflowActions._retrieval_cache.move_to_end(cache_key)
+        if cached is not None:
+            logger.info("Step: Using cached document search results")
+            return {"context_obj": {"documents": cached} if cached else {}}
+
         if chat_history:
             logger.info("Step: Reformulating query with chat history context")
 
-        docs = self.__history_aware_retriever.invoke({
-            "input": question,
-            "chat_history": chat_history,
-        })
+        standalone_question = state.get("standalone_question")
+        if chat_history and standalone_question:
+            # `prepare` already reformulated the question; only the vector
+            # search remains.
+            docs = await asyncio.to_thread(self.__doc_store.search, standalone_question)
+        elif chat_history:
+            docs = await self.__history_aware_retriever.ainvoke({
+                "input": question,
+                "chat_history": chat_history,
+            })
+        else:
+            # Without history the question is already standalone, so search
+            # with the embedding computed at graph entry.
+            question_embedding = await self.__get_question_embedding(state)
+            docs = await asyncio.to_thread(
+                self.__doc_store.search_by_vector, question_embedding
+            )
 
         # Build a list of document dicts and encode as TOON.
         # Each document is represented with its source metadata (if available)
-        # and its text content.
-        doc_records = [
-            {
-                "source": doc.metadata.get("source", "unknown") if doc.metadata else "unknown",
-                "content": doc.page_content,
-            }
-            for doc in docs
-        ]
-        return {"context": ToonSerializer.dumps({"documents": doc_records})}
+        # and its text content. Whitespace runs are collapsed (they bloat
+        # TOON rows) and chunks repeated from the same source are dropped.
+        doc_records = []
+        seen = set()
+        for doc in docs:
+            source = doc.metadata.get("source", "unknown") if doc.metadata else "unknown"
+            content = " ".join(doc.page_content.split())
+            if (source, content) in seen:
+                continue
+            seen.add((source, content))
+            doc_records.append({"source": source, "content": content})
+        with WorkflowActions._retrieval_cache_lock:
+            WorkflowActions._retrieval_cache[cache_key] = doc_records
+            if len(WorkflowActions._retrieval_cache) > WorkflowActions._RETRIEVAL_CACHE_MAXSIZE:
+                WorkflowActions._retrieval_cache.popitem(last=False)
+        # Leave context_obj empty when nothing matched so that
+        # `decide_after_doc_search` can fall back to the web.
+        return {"context_obj": {"documents": doc_records} if doc_records else {}}
+
+    async def parallel_search(self, state: dict) -> dict:
+        """Run document search and web search concurrently.
+
+        Used when the router asks for web context: the local document store
+        is consulted at the same time, so the combined latency is that of the
+        slower search rather than the sum of both.
+
+        Args:
+            state (dict): The current graph state.
+
+        Returns:
+            state (dict): Merged document and web results in context_obj.
+        """
+        logger.info("Step: Searching Document Store and Web in parallel")
+        doc_result, web_result = await asyncio.gather(
+            self.doc_search(state), self.web_search(state)
+        )
+        return {"context_obj": {**doc_result["context_obj"], **web_result["context_obj"]}}
+
+    async def speculative_search(self, state: dict) -> dict:
+        """Search documents while speculatively starting a web search.
+
+        Replaces the sequential doc_search -> web_search fallback when
+        internet search is enabled. The web search is started alongside the
+        document search; if documents are found the web search is cancelled
+        and only the document context is kept, otherwise the web results are
+        used.
+
+        Cancelling only stops the coroutine: a DuckDuckGo or Wikipedia call
+        already running in a worker thread (`asyncio.to_thread`) finishes in
+        the background and its result is dropped, so a document hit still
+        spends one web request against the search rate limiter.
+
+        Args:
+            state (dict): The current graph state.
+
+        Returns:
+            state (dict): Document context_obj, or the web one if no
+                documents matched.
+        """
+        logger.info("Step: Searching Document Store with speculative Web Search")
+        web_task = asyncio.create_task(self.web_search(state))
+        try:
+            doc_result = await self.doc_search(state)
+        except BaseException:
+            await self.__discard_task(web_task)
+            raise
+
+        if doc_result["context_obj"]:
+            logger.info("Step: Relevant documents found. Discarding Web Search.")
+            await self.__discard_task(web_task)
+            return doc_result
+
+        logger.info("Step: No relevant documents found. Using Web Search results.")
+        return await web_task
+
+    @staticmethod
+    async def __discard_task(task: asyncio.Task) -> None:
+        """Cancel *task*, wait for it to finish and retrieve its outcome.
+
+        Waiting via `asyncio.wait` rather than awaiting the task directly
+        means the task's own CancelledError or failure is consumed here
+        (so it is never reported as unretrieved), while a cancellation of
+        the caller still propagates.
+
+        Args:
+            task (asyncio.Task): Task whose result is no longer needed.
+        """
+        task.cancel()
+        await asyncio.wait([task])
+        if not task.cancelled() and task.exception() is not None:
+            logger.info("Step: Discarded web search had failed: %s", task.exception())
 
     def decide_after_doc_search(self, state: dict) -> str:
         """Determine whether to proceed to web search or generation.
@@ -197,8 +411,7 @@ class WorkflowActions:
         Returns:
             str: Next node to call.
         """
-        context = state.get("context", "")
-        if not context or len(context.strip()) == 0:
+        if not state.get("context_obj"):
             if self.__enable_internet_search:
                 logger.info("Step: No relevant documents found. Routing to Web Search.")
                 return "web_search"
@@ -209,34 +422,89 @@ class WorkflowActions:
             logger.info("Step: Relevant documents found. Routing to Generation.")
             return "generate"
 
-    def route_question(self, state: dict) -> str:
-        """Route question to document search or generation.
+    @staticmethod
+    def __match_route_keywords(question: str) -> str | None:
+        """Return the route for an unambiguous question, else None.
+
+        Args:
+            question (str): The user question.
 
-        Uses the router template to determine whether the question may be
-        answered from the local document store (doc_search) or directly from
-        the model's internal knowledge (generate).
+        Returns:
+            str | None: 'web_search' or 'doc_search' when exactly one
+                keyword pattern matches, otherwise None.
+        """
+        web = _WEB_ROUTE_RE.search(question) is not None
+        doc = _DOC_ROUTE_RE.search(question) is not None
+        if web == doc:
+            return None
+        return "web_search" if web else "doc_search"
+
+    async def prepare(self, state: dict) -> dict:
+        """Route the question and prepare search inputs in one LLM round-trip.
+
+        The route comes from the semantic route cache or the keyword
+        pre-filter when possible. Whatever is still unknown among the route,
+        the optimized web query and the standalone (history-free) question is
+        requested from the model concurrently via `Prompt.get_prep_chain`,
+        instead of as sequential calls from `route_question`, `web_search`
+        and the history-aware retriever. A failed or malformed branch leaves
+        its value empty (or the route at doc_search), so `web_search` and
+        `doc_search` fall back to their own query rewriting as before.
 
         Args:
             state (dict): The current graph state.
 
         Returns:
-            str: Next node to call — either 'doc_search' or 'generate'.
+            state (dict): New keys added to state, route, search_query and
+                standalone_question.
         """
         logger.info("Step: Routing Query")
         question = state['question']
-        output = self.__agent_prompt.get_router_chain.invoke(
-            {"question": question}
+        question_embedding = await self.__get_question_embedding(state)
+        choice = WorkflowActions._route_cache.get(
+            question_embedding, key=self.__agent_prompt.model
         )
-        logger.info(f"Chain output: {output!r}")
-
-        # Default to doc_search so we always try the document store when uncertain
-        choice = output.get('choice', 'doc_search')
-        if choice not in ('doc_search', 'web_search', 'generate'):
-            logger.warning(
-                "Router returned unrecognized choice %r; defaulting to doc_search.",
-                choice,
+        if choice is None:
+            choice = self.__match_route_keywords(question)
+            if choice is not None:
+                logger.info("Step: Route decided by keyword pre-filter")
+        else:
+            logger.info("Step: Using cached route for a similar question")
+
+        chat_history = self.__history_messages(state.get("history", []))
+        searches = (None, "doc_search", "web_search")
+        needs_route = choice is None
+        # doc_search falls back to (or runs alongside) web search when
+        # internet search is enabled, so it needs the web query as well.
+        needs_query = self.__enable_internet_search and choice in searches
+        needs_standalone = bool(chat_history) and choice in searches
+
+        output = {}
+        if needs_route or needs_query or needs_standalone:
+            prep_chain = self.__agent_prompt.get_prep_chain(
+                route=needs_route, query=needs_query, standalone=needs_standalone
             )
-            choice = 'doc_search'
+            output = await prep_chain.ainvoke({
+                "question": question,
+                "input": question,
+                "chat_history": chat_history,
+            })
+
+        if needs_route:
+            logger.info(f"Chain output: {output['route']!r}")
+            # Default to doc_search so we always try the document store when uncertain
+            route = output["route"]
+            choice = route.get("choice") if isinstance(route, dict) else None
+            if choice not in ('doc_search', 'web_search', 'generate'):
+                logger.warning(
+                    "Router returned unrecognized choice %r; defaulting to doc_search.",
+                    choice,
+                )
+                choice = 'doc_search'
+            else:
+                WorkflowActions._route_cache.put(
+                    question_embedding, choice, key=self.__agent_prompt.model
+                )
 
         # Force doc_search if model attempts disabled web_search
         if choice == 'web_search' and not self.__enable_internet_search:
@@ -246,6 +514,28 @@ class WorkflowActions:
             )
             choice = 'doc_search'
 
+        query = output.get("query")
+        search_query = query.get("query") if isinstance(query, dict) else None
+        standalone = output.get("standalone")
+        return {
+            "route": choice,
+            "search_query": search_query if isinstance(search_query, str) else "",
+            "standalone_question": standalone if isinstance(standalone, str) else "",
+        }
+
+    def route_question(self, state: dict) -> str:
+        """Route question to document search, web search or generation.
+
+        The decision itself is made by `prepare`; this edge function reads
+        it from the state.
+
+        Args:
+            state (dict): The current graph state.
+
+        Returns:
+            str: Next node to call — 'doc_search', 'web_search' or 'generate'.
+        """
+        choice = state["route"]
         logger.info(f"Step: Router Decision: {choice}")
         if choice == "doc_search":
             logger.info("Step: Routing Query to Document Search")
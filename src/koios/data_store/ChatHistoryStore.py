@@ -12,20 +12,29 @@ version 0.1.0
 from __future__ import annotations
 
 import os
-from datetime import datetime, timezone
-from typing import List
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 
 from sqlalchemy import (
     Column,
     DateTime,
+    Index,
     Integer,
     String,
     Text,
+    bindparam,
     create_engine,
+    event,
     select,
+    text,
     delete,
+    insert,
+    update,
     func,
 )
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
 
 from src.config import config, logger
@@ -47,9 +56,12 @@ class ChatMessageRecord(ChatBase):
     """
 
     __tablename__ = "chat_messages"
+    # Every query filters by user and orders by time; the composite index
+    # answers them with a single range scan and no sort step.
+    __table_args__ = (Index("ix_user_created", "user_id", "created_at"),)
 
     id: int = Column(Integer, primary_key=True, autoincrement=True)
-    user_id: str = Column(String(256), nullable=False, index=True)
+    user_id: str = Column(String(256), nullable=False)
     role: str = Column(String(16), nullable=False)
     content: str = Column(Text, nullable=False)
     created_at: datetime = Column(
@@ -74,100 +86,412 @@ class ChatHistoryStore:
     Args:
         db_path (str): Filesystem path to the SQLite database file.
             Defaults to `db/chat_history.sqlite`.
+        expire_prefix (Optional[str]): If set together with *expire_after*,
+            `maintenance()` deletes the history of every user id starting
+            with this prefix that has been idle for longer than that.
+        expire_after (Optional[timedelta]): Idle time after which such
+            histories are deleted.
     """
 
-    def __init__(self, db_path: str = "db/chat_history.sqlite") -> None:
+    # Messages written between automatic `maintenance()` runs.
+    _MAINTENANCE_INTERVAL = 500
+
+    def __init__(
+        self,
+        db_path: str = "db/chat_history.sqlite",
+        expire_prefix: Optional[str] = None,
+        expire_after: Optional[timedelta] = None,
+    ) -> None:
         # Ensure the parent directory exists (mirrors how ChromaDB uses db/).
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
+        # SQLite admits one writer at a time, so the write pool stays small;
+        # reads get their own pool so they never queue behind a writer.
         engine = create_engine(
             f"sqlite:///{db_path}",
             connect_args={"check_same_thread": False},
             echo=False,
+            pool_size=1,
+            max_overflow=4,
+            query_cache_size=1200,
+        )
+        event.listen(engine, "connect", self._set_sqlite_pragmas)
+        read_engine = create_engine(
+            f"sqlite:///{db_path}",
+            connect_args={"check_same_thread": False},
+            echo=False,
+            pool_size=4,
+            max_overflow=8,
+            query_cache_size=1200,
         )
+        event.listen(read_engine, "connect", self._set_sqlite_read_pragmas)
         ChatBase.metadata.create_all(engine)
+        # `create_all` skips indexes on tables that already exist, so bring
+        # older databases up to date: add the composite index and drop the
+        # single-column one it supersedes.
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_user_created "
+                "ON chat_messages (user_id, created_at)"
+            ))
+            conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_user_id"))
+        self._engine = engine
         self._Session: sessionmaker[Session] = sessionmaker(bind=engine)
+        self._ReadSession: sessionmaker[Session] = sessionmaker(bind=read_engine)
+        # Per-user history as last read or written by this process. Writes
+        # bump `_history_versions` before and after committing, so a read
+        # that overlapped a write is never cached.
+        self._history_cache: dict[str, List[dict]] = {}
+        self._history_versions: dict[str, int] = {}
+        self._history_lock = threading.Lock()
+        self._writes_since_maintenance = 0
+        self._expire_prefix = expire_prefix
+        self._expire_after = expire_after
+        self.__prepare_statements()
         logger.info("ChatHistoryStore initialised at %s", db_path)
 
+    def __prepare_statements(self) -> None:
+        """Build the hot-path statements once, with bound parameters.
+
+        Each statement object is reused on every call, so SQLAlchemy's
+        compiled cache serves it without rebuilding the expression tree;
+        per-call values are supplied as parameters.
+        """
+        table = ChatMessageRecord.__table__
+        self._q_history = (
+            select(ChatMessageRecord.role, ChatMessageRecord.content)
+            .where(ChatMessageRecord.user_id == bindparam("user_id"))
+            .order_by(ChatMessageRecord.created_at.asc(), ChatMessageRecord.id.asc())
+            .limit(bindparam("limit"))
+        )
+        self._q_count = (
+            select(func.count())
+            .select_from(table)
+            .where(table.c.user_id == bindparam("user_id"))
+        )
+        self._q_insert = insert(table)
+        self._q_recycle = self._recycle_statement()
+        self._q_trim = self._trim_statement()
+        self._q_delete_user = delete(table).where(table.c.user_id == bindparam("user_id"))
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, _connection_record) -> None:
+        """Tune each new SQLite connection for concurrent chat writes.
+
+        WAL lets readers proceed alongside a writer and turns commits into
+        sequential appends; `synchronous=NORMAL` drops the per-commit fsync
+        that WAL makes unnecessary. `busy_timeout` makes a writer wait for
+        the lock instead of failing with "database is locked", and
+        `wal_autocheckpoint` keeps the WAL file bounded. The remaining
+        pragmas keep temp tables and hot pages in memory.
+        """
+        cursor = dbapi_connection.cursor()
+        # Only takes effect on a new, empty database (before `create_all`);
+        # existing files keep their mode, making this a harmless no-op.
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA wal_autocheckpoint=1000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
+    @staticmethod
+    def _set_sqlite_read_pragmas(dbapi_connection, _connection_record) -> None:
+        """Tune each new read-pool connection and make it read-only.
+
+        `query_only` rejects writes on these connections. It is used instead
+        of opening the file with `mode=ro`, which cannot open a WAL database
+        while its `-shm` file is absent.
+        """
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        cursor.close()
+
     def get_history(self, user_id: str) -> List[dict]:
         """Return the stored chat history for *user_id* as a list of dicts.
 
         Messages are returned in chronological order (oldest first) and are
         capped at :data:`config.max_messages_per_user` entries.
 
+        Results are cached in-process and kept current by this store's own
+        writes, so repeated reads (e.g. every Streamlit rerun) skip SQLite.
+        Writes made by other processes are not seen until the entry is
+        invalidated by a write or clear from this process.
+
         Args:
             user_id (str): The user identifier.
 
         Returns:
             list[dict]: List of `{"role": ..., "content": ...}` dicts.
         """
-        with self._Session() as session:
-            stmt = (
-                select(ChatMessageRecord)
-                .where(ChatMessageRecord.user_id == user_id)
-                .order_by(ChatMessageRecord.created_at.asc())
-                .limit(config.max_messages_per_user)
-            )
-            records = session.scalars(stmt).all()
-            return [r.to_dict() for r in records]
+        with self._history_lock:
+            cached = self._history_cache.get(user_id)
+            if cached is not None:
+                return list(cached)
+            version = self._history_versions.get(user_id, 0)
+
+        with self._ReadSession() as session:
+            # Plain rows rather than ORM objects: no identity-map entries and
+            # no parsing of columns the agent never reads.
+            rows = session.execute(
+                self._q_history,
+                {"user_id": user_id, "limit": config.max_messages_per_user},
+            ).all()
+            history = [{"role": role, "content": content} for role, content in rows]
+
+        with self._history_lock:
+            if self._history_versions.get(user_id, 0) == version:
+                self._history_cache[user_id] = history
+        return list(history)
 
     def add_message(self, user_id: str, role: str, content: str) -> None:
         """Append a single message to *user_id*'s history.
 
-        If the user already has :data:`config.max_messages_per_user` messages stored,
-        the oldest message is deleted before the new one is inserted (sliding
-        window).
+        Shorthand for `add_messages` with one message: the insert and the
+        sliding-window trim run in one transaction.
 
         Args:
             user_id (str): The user identifier.
             role (str): `"user"` or `"assistant"`.
             content (str): The message text.
         """
-        with self._Session() as session:
-            # Count existing messages for this user.
-            count: int = session.scalar(
-                select(func.count()).where(ChatMessageRecord.user_id == user_id)
-            ) or 0
-
-            if count >= config.max_messages_per_user:
-                # Delete the oldest message(s) to make room.
-                overflow = count - config.max_messages_per_user + 1
-                oldest_ids_stmt = (
-                    select(ChatMessageRecord.id)
-                    .where(ChatMessageRecord.user_id == user_id)
-                    .order_by(ChatMessageRecord.created_at.asc())
-                    .limit(overflow)
+        self.add_messages(user_id, [{"role": role, "content": content}])
+
+    def add_messages(self, user_id: str, messages: List[dict]) -> None:
+        """Append multiple messages at once.
+
+        Every :attr:`_MAINTENANCE_INTERVAL` messages, :meth:`maintenance`
+        runs after the write has committed.
+
+        The history is treated as a ring of :data:`config.max_messages_per_user`
+        rows: once a user is at the cap, each new message overwrites that
+        user's oldest row in place with an UPDATE instead of a DELETE plus an
+        INSERT, so the primary key and index entries are reused. Messages
+        below the cap are inserted with a single executemany. Everything runs
+        in one transaction.
+
+        Args:
+            user_id (str): The user identifier.
+            messages (list[dict]): List of `{"role", "content"}` dicts.
+        """
+        if not messages:
+            return
+        now = datetime.now(timezone.utc)
+        # Distinct timestamps keep the batch in order even when recycled
+        # rows have out-of-order ids.
+        rows = [
+            {
+                "user_id": user_id,
+                "role": msg["role"],
+                "content": msg["content"],
+                "created_at": now + timedelta(microseconds=i),
+            }
+            for i, msg in enumerate(messages)
+        ]
+        max_messages = config.max_messages_per_user
+        # Take the cached history out before writing, so no reader can pair
+        # it with the new rows; it is extended and put back after the commit.
+        with self._history_lock:
+            version = self._history_versions.get(user_id, 0) + 1
+            self._history_versions[user_id] = version
+            base = self._history_cache.pop(user_id, None)
+        committed = False
+        try:
+            self.__write_messages(user_id, rows, max_messages)
+            committed = True
+        finally:
+            with self._history_lock:
+                # Unchanged version: no other write for this user overlapped
+                # ours, so `base` plus our messages is the committed history.
+                undisturbed = self._history_versions.get(user_id, 0) == version
+                self._history_versions[user_id] = self._history_versions.get(user_id, 0) + 1
+                if committed and undisturbed and base is not None:
+                    history = base + [
+                        {"role": m["role"], "content": m["content"]} for m in messages
+                    ]
+                    self._history_cache[user_id] = history[-max_messages:]
+                else:
+                    # Whatever a concurrent read stored may predate the commit.
+                    self._history_cache.pop(user_id, None)
+                self._writes_since_maintenance += len(messages)
+                due = self._writes_since_maintenance >= self._MAINTENANCE_INTERVAL
+                if due:
+                    self._writes_since_maintenance = 0
+        if due:
+            self.maintenance()
+
+    def __write_messages(self, user_id: str, rows: List[dict], max_messages: int) -> None:
+        """Write *rows* for *user_id* in one transaction (see `add_messages`).
+
+        Args:
+            user_id (str): The user identifier.
+            rows (list[dict]): Column values for the new messages.
+            max_messages (int): Per-user message cap.
+        """
+        # `begin()` commits on exit and rolls back on error, so the writes
+        # land together or not at all.
+        with self._Session.begin() as session:
+            count = session.scalar(self._q_count, {"user_id": user_id}) or 0
+            overflow = max(0, count + len(rows) - max_messages)
+            recycled = min(overflow, len(rows))
+            if recycled:
+                session.execute(
+                    self._q_recycle,
+                    [
+                        {
+                            "target_user": user_id,
+                            "new_role": row["role"],
+                            "new_content": row["content"],
+                            "new_created_at": row["created_at"],
+                        }
+                        for row in rows[:recycled]
+                    ],
                 )
-                oldest_ids = list(session.scalars(oldest_ids_stmt).all())
+            if recycled < len(rows):
+                session.execute(self._q_insert, rows[recycled:])
+            # Only needed when the user was already over the cap, e.g. after
+            # `max_messages_per_user` was lowered.
+            if overflow > len(rows):
                 session.execute(
-                    delete(ChatMessageRecord).where(
-                        ChatMessageRecord.id.in_(oldest_ids)
-                    )
+                    self._q_trim,
+                    {"user_id": user_id, "keep_offset": max(0, max_messages - 1)},
                 )
 
-            session.add(
-                ChatMessageRecord(
-                    user_id=user_id,
-                    role=role,
-                    content=content,
-                    created_at=datetime.now(timezone.utc),
-                )
+    def maintenance(self) -> None:
+        """Expire idle histories, reclaim free pages and truncate the WAL file.
+
+        If the store was created with `expire_prefix` and `expire_after`,
+        idle histories under that prefix are deleted first (see
+        `delete_inactive_users`). The sliding window constantly frees pages; `incremental_vacuum`
+        returns up to 1000 of them to the filesystem (databases created
+        with `auto_vacuum=INCREMENTAL` only), and a TRUNCATE checkpoint
+        copies the WAL back into the database and resets it to zero bytes.
+        Failures (e.g. the database is locked) are logged, not raised, since
+        callers run this after their own write has already committed.
+        """
+        try:
+            if self._expire_prefix and self._expire_after is not None:
+                self.delete_inactive_users(self._expire_prefix, self._expire_after)
+            raw = self._engine.raw_connection()
+            try:
+                cursor = raw.cursor()
+                # `incremental_vacuum` frees one page per step and returns no
+                # rows; `executescript` steps it to completion, whereas a
+                # single `execute` would free only the first page.
+                cursor.executescript("PRAGMA incremental_vacuum(1000);")
+                cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+                cursor.close()
+            finally:
+                raw.close()
+        except (SQLAlchemyError, sqlite3.Error) as exc:
+            logger.warning("ChatHistoryStore maintenance skipped: %s", exc)
+
+    def delete_inactive_users(self, prefix: str, older_than: timedelta) -> int:
+        """Delete the history of every idle user whose id starts with *prefix*.
+
+        A user is idle when their newest message is older than *older_than*.
+
+        Args:
+            prefix (str): User id prefix, matched literally.
+            older_than (timedelta): Idle time after which a history is deleted.
+
+        Returns:
+            int: Number of messages deleted.
+        """
+        table = ChatMessageRecord.__table__
+        cutoff = datetime.now(timezone.utc) - older_than
+        inactive = (
+            select(table.c.user_id)
+            .where(table.c.user_id.startswith(prefix, autoescape=True))
+            .group_by(table.c.user_id)
+            .having(func.max(table.c.created_at) < cutoff)
+        )
+        with self._Session.begin() as session:
+            user_ids = session.scalars(inactive).all()
+            if not user_ids:
+                return 0
+            result = session.execute(delete(table).where(table.c.user_id.in_(inactive)))
+        with self._history_lock:
+            for user_id in user_ids:
+                self._history_versions[user_id] = self._history_versions.get(user_id, 0) + 1
+                self._history_cache.pop(user_id, None)
+        logger.info(
+            "Deleted %d message(s) of %d inactive user(s) under '%s'",
+            result.rowcount, len(user_ids), prefix,
+        )
+        return result.rowcount
+
+    @staticmethod
+    def _recycle_statement():
+        """Build the UPDATE that overwrites a user's oldest message.
+
+        Executed once per parameter set (`target_user`, `new_role`,
+        `new_content`, `new_created_at`); each execution sees the previous
+        one's write, so consecutive executions overwrite successive oldest
+        rows.
+
+        Returns:
+            Update: Core UPDATE statement on `chat_messages`.
+        """
+        table = ChatMessageRecord.__table__
+        oldest_id = (
+            select(table.c.id)
+            .where(table.c.user_id == bindparam("target_user"))
+            .order_by(table.c.created_at.asc(), table.c.id.asc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        return (
+            update(table)
+            .where(table.c.id == oldest_id)
+            .values(
+                role=bindparam("new_role"),
+                content=bindparam("new_content"),
+                created_at=bindparam("new_created_at"),
             )
-            session.commit()
+        )
 
-    def add_messages(self, user_id: str, messages: List[dict]) -> None:
-        """Convenience wrapper to append multiple messages at once.
+    @staticmethod
+    def _trim_statement():
+        """Build the DELETE that keeps only a user's newest messages.
 
-        Args:
-            user_id (str): The user identifier.
-            messages (list[dict]): List of `{"role", "content"}` dicts.
+        Takes `user_id` and `keep_offset` (the window size minus one) as
+        parameters. The subquery looks up the `created_at` of the oldest
+        message still inside the window, and everything older is deleted as
+        one range on the `(user_id, created_at)` index. If the user has no
+        more messages than the window, the cutoff is NULL and nothing is
+        deleted. Rows that share the cutoff timestamp are kept.
+
+        Returns:
+            Delete: Core DELETE statement on `chat_messages`.
         """
-        for msg in messages:
-            self.add_message(user_id, msg["role"], msg["content"])
+        table = ChatMessageRecord.__table__
+        cutoff = (
+            select(table.c.created_at)
+            .where(table.c.user_id == bindparam("user_id"))
+            .order_by(table.c.created_at.desc())
+            .offset(bindparam("keep_offset"))
+            .limit(1)
+            .scalar_subquery()
+        )
+        return (
+            delete(table)
+            .where(table.c.user_id == bindparam("user_id"))
+            .where(table.c.created_at < cutoff)
+        )
 
     def clear_history(self, user_id: str) -> int:
         """Delete all stored messages for *user_id*.
 
+        Runs :meth:`maintenance` afterwards to release the freed pages.
+
         Args:
             user_id (str): The user identifier.
 
@@ -175,17 +499,17 @@ class ChatHistoryStore:
             int: Number of messages deleted.
         """
         with self._Session() as session:
-            result = session.execute(
-                delete(ChatMessageRecord).where(
-                    ChatMessageRecord.user_id == user_id
-                )
-            )
+            result = session.execute(self._q_delete_user, {"user_id": user_id})
             session.commit()
             deleted = result.rowcount
+            with self._history_lock:
+                self._history_versions[user_id] = self._history_versions.get(user_id, 0) + 1
+                self._history_cache[user_id] = []
             logger.info(
                 "Cleared %d message(s) for user '%s'", deleted, user_id
             )
-            return deleted
+        self.maintenance()
+        return deleted
 
     def get_message_count(self, user_id: str) -> int:
         """Return the number of messages currently stored for *user_id*.
@@ -196,10 +520,8 @@ class ChatHistoryStore:
         Returns:
             int: Message count.
         """
-        with self._Session() as session:
-            return session.scalar(
-                select(func.count()).where(ChatMessageRecord.user_id == user_id)
-            ) or 0
+        with self._ReadSession() as session:
+            return session.scalar(self._q_count, {"user_id": user_id}) or 0
 
     def list_users(self) -> List[str]:
         """Return a list of all user IDs that have stored messages.
@@ -207,7 +529,7 @@ class ChatHistoryStore:
         Returns:
             list[str]: Distinct user IDs.
         """
-        with self._Session() as session:
+        with self._ReadSession() as session:
             rows = session.scalars(
                 select(ChatMessageRecord.user_id).distinct()
             ).all()
@@ -5,9 +5,16 @@ Document store class for managing PDF embeddings and retrieval.
 Author: Cline
 version 0.1.0
 """
+import hashlib
 import os
-from typing import List
-from langchain_community.document_loaders import PyPDFLoader
+import sqlite3
+import threading
+import uuid
+from array import array
+from contextlib import closing
+from functools import cached_property
+from typing import List, Optional
+from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
@@ -18,6 +25,19 @@ from langchain_core.vectorstores import VectorStoreRetriever
 class DocumentStore:
     """Manages PDF loading, embedding, and retrieval."""
 
+    # Chunks embedded and written to Chroma per round-trip during ingest.
+    __INGEST_BATCH_SIZE = 64
+
+    # Bumped whenever any store adds or removes documents, so callers can
+    # invalidate caches derived from search results.
+    _version = 0
+    _version_lock = threading.Lock()
+
+    # Process-wide instances keyed by persist directory, so every workflow
+    # and the UI share one embedding model and one Chroma client.
+    _shared_instances: dict[str, "DocumentStore"] = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self, persist_directory: str = "db"):
         """Initialize the document store.
 
@@ -25,26 +45,193 @@ class DocumentStore:
             persist_directory (str): Directory to persist the vector store.
         """
         self.__persist_directory = persist_directory
-        self.__embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        self.__vectorstore = Chroma(
+        # Chunk embeddings keyed by SHA-256 of the chunk text, so re-indexing
+        # an unchanged document does not re-run the encoder.
+        os.makedirs(self.__persist_directory, exist_ok=True)
+        self.__embedding_cache_path = os.path.join(
+            self.__persist_directory, "embedding_cache.sqlite"
+        )
+        with closing(sqlite3.connect(self.__embedding_cache_path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embedding_cache "
+                "(hash BLOB PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+
+    @cached_property
+    def __embeddings(self) -> HuggingFaceEmbeddings:
+        """Embedding model, loaded on first use.
+
+        Loading MiniLM takes seconds and hundreds of MB, so processes that
+        never embed anything do not pay for it.
+
+        Returns:
+            HuggingFaceEmbeddings: Sentence-transformer embedding model.
+        """
+        return HuggingFaceEmbeddings(
+            model_name="all-MiniLM-L6-v2",
+            model_kwargs=self.__get_model_kwargs(),
+            encode_kwargs={"batch_size": 64, "normalize_embeddings": True},
+        )
+
+    @cached_property
+    def __vectorstore(self) -> Chroma:
+        """Chroma collection, opened on first use.
+
+        HNSW parameters are tuned for the k=3 queries issued by the agent.
+        They only take effect when the collection is first created.
+
+        Returns:
+            Chroma: Persistent vector store.
+        """
+        return Chroma(
             collection_name="koios_collection",
             persist_directory=self.__persist_directory,
-            embedding_function=self.__embeddings
+            embedding_function=self.__embeddings,
+            collection_metadata={
+                "hnsw:space": "cosine",
+                "hnsw:M": 32,
+                "hnsw:construction_ef": 200,
+                "hnsw:search_ef": 64,
+            },
         )
 
-    def add_pdf(self, file_path: str) -> None:
+    @classmethod
+    def shared(cls, persist_directory: str = "db") -> "DocumentStore":
+        """Return the process-wide store for *persist_directory*.
+
+        Args:
+            persist_directory (str): Directory to persist the vector store.
+
+        Returns:
+            DocumentStore: Store created on first call and reused afterwards.
+        """
+        with cls._shared_lock:
+            store = cls._shared_instances.get(persist_directory)
+            if store is None:
+                store = cls(persist_directory)
+                cls._shared_instances[persist_directory] = store
+            return store
+
+    @classmethod
+    def version(cls) -> int:
+        """Return the current document-set version.
+
+        Returns:
+            int: Counter incremented on every add or clear.
+        """
+        return cls._version
+
+    @classmethod
+    def __bump_version(cls) -> None:
+        """Mark the document set as changed."""
+        with cls._version_lock:
+            cls._version += 1
+
+    @staticmethod
+    def __get_model_kwargs() -> dict:
+        """Select the device and precision for the embedding model.
+
+        On CUDA the model is loaded in FP16, halving weight and activation
+        bandwidth; otherwise it runs in FP32 on the CPU.
+
+        Returns:
+            dict: Keyword arguments for `SentenceTransformer`.
+        """
+        # Deferred with the model itself; importing torch alone costs
+        # noticeable startup time.
+        import torch
+
+        if torch.cuda.is_available():
+            return {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+        return {"device": "cpu"}
+
+    def add_pdf(self, file_path: str, file_hash: Optional[str] = None) -> None:
         """Load a PDF, split it into chunks, and add to the vector store.
 
+        Pages are read one at a time and their chunks are embedded and
+        written in batches, so peak memory is bounded by the batch rather
+        than by the whole document.
+
         Args:
             file_path (str): Path to the PDF file.
+            file_hash (Optional[str]): Content hash of the file, stored in
+                each chunk's metadata so `has_file_hash` can detect
+                re-uploads of the same content.
         """
-        loader = PyPDFLoader(file_path)
-        documents = loader.load()
-        
+        loader = PyMuPDFLoader(file_path)
         text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(documents)
-        
-        self.__vectorstore.add_documents(splits)
+
+        batch: List[Document] = []
+        for page in loader.lazy_load():
+            if file_hash:
+                page.metadata["file_hash"] = file_hash
+            batch.extend(text_splitter.split_documents([page]))
+            if len(batch) >= self.__INGEST_BATCH_SIZE:
+                self.__add_splits(batch)
+                batch = []
+        if batch:
+            self.__add_splits(batch)
+
+    def __add_splits(self, splits: List[Document]) -> None:
+        """Embed *splits* and write them to the collection.
+
+        Args:
+            splits (List[Document]): Chunks to add.
+        """
+        texts = [split.page_content for split in splits]
+        embeddings = self.__embed_with_cache(texts)
+
+        # Add pre-computed embeddings directly so Chroma does not embed again.
+        self.__vectorstore._collection.add(
+            ids=[str(uuid.uuid4()) for _ in splits],
+            embeddings=embeddings,
+            metadatas=[split.metadata for split in splits],
+            documents=texts,
+        )
+        self.__bump_version()
+
+    def __embed_with_cache(self, texts: List[str]) -> List[List[float]]:
+        """Embed *texts*, reusing cached vectors for previously seen chunks.
+
+        Cache misses are embedded in a single batched `embed_documents` call
+        and written back to the cache.
+
+        Args:
+            texts (List[str]): Chunk texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per input text, in order.
+        """
+        hashes = [hashlib.sha256(text.encode("utf-8")).digest() for text in texts]
+        vectors: dict[bytes, List[float]] = {}
+
+        with closing(sqlite3.connect(self.__embedding_cache_path)) as conn, conn:
+            unique_hashes = list(dict.fromkeys(hashes))
+            # Stay well below SQLite's bound-parameter limit.
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, vec FROM embedding_cache WHERE hash IN ({placeholders})",
+                    batch,
+                )
+                for digest, blob in rows:
+                    vectors[digest] = array("f", blob).tolist()
+
+            missing = {
+                digest: text for digest, text in zip(hashes, texts)
+                if digest not in vectors
+            }
+            if missing:
+                new_vectors = self.__embeddings.embed_documents(list(missing.values()))
+                for digest, vector in zip(missing, new_vectors):
+                    vectors[digest] = vector
+                conn.executemany(
+                    "INSERT OR IGNORE INTO embedding_cache (hash, vec) VALUES (?, ?)",
+                    [(digest, array("f", vectors[digest]).tobytes()) for digest in missing],
+                )
+
+        return [vectors[digest] for digest in hashes]
 
     def search(self, query: str, k: int = 3) -> List[Document]:
         """Search for relevant documents.
@@ -58,6 +245,29 @@ class DocumentStore:
         """
         return self.__vectorstore.similarity_search(query, k=k)
 
+    def search_by_vector(self, embedding: List[float], k: int = 3) -> List[Document]:
+        """Search for relevant documents using a precomputed query embedding.
+
+        Args:
+            embedding (List[float]): Query embedding.
+            k (int): Number of documents to retrieve.
+
+        Returns:
+            List[Document]: List of relevant documents.
+        """
+        return self.__vectorstore.similarity_search_by_vector(embedding, k=k)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed *text* with the store's embedding model.
+
+        Args:
+            text (str): Text to embed.
+
+        Returns:
+            List[float]: Embedding vector.
+        """
+        return self.__embeddings.embed_query(text)
+
     def get_retriever(self, k: int = 3) -> VectorStoreRetriever:
         """Return a LangChain retriever backed by the vector store.
 
@@ -69,6 +279,20 @@ class DocumentStore:
         """
         return self.__vectorstore.as_retriever(search_kwargs={"k": k})
 
+    def has_file_hash(self, file_hash: str) -> bool:
+        """Check whether a file with this content hash is already indexed.
+
+        Args:
+            file_hash (str): Hash passed to `add_pdf`.
+
+        Returns:
+            bool: True if any chunk carries *file_hash*.
+        """
+        results = self.__vectorstore.get(
+            where={"file_hash": file_hash}, limit=1, include=[]
+        )
+        return bool(results.get("ids"))
+
     def get_all_documents(self) -> List[str]:
         """Get a list of unique source filenames in the store.
 
@@ -89,3 +313,4 @@ class DocumentStore:
         ids = results.get("ids", [])
         if ids:
             self.__vectorstore.delete(ids=ids)
+            self.__bump_version()
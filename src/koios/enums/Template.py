@@ -17,11 +17,11 @@ class Template(Enum):
     def __init__(self, value: str):
         super().__init__(value)
         src_dir_path = Path(__file__).parent.parent
-        self.__target_dir_path = src_dir_path.joinpath("read_template")
+        # Constant per member, so build it once instead of on every access.
+        self.__path = str(
+            src_dir_path / "read_template" / "prompt_templates" / f"{value}.txt"
+        )
 
     @property
     def path(self) -> str:
-        return "{}/prompt_templates/{}.txt".format(
-            self.__target_dir_path,
-            self.value
-        )
+        return self.__path
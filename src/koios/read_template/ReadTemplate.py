@@ -5,6 +5,7 @@ Read template file and return output to be used as llm prompt.
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
+import functools
 import os
 import re
 from transformers import AutoTokenizer
@@ -18,17 +19,27 @@ class ReadTemplate:
     _instance = None
 
     # Maps model name patterns (regex) to HuggingFace tokenizer IDs.
-    # Ungated mirrors are preferred so no HF_TOKEN is required.
-    _TOKENIZER_MAP: dict[str, str] = {
-        r"llama":           "unsloth/Llama-3.2-1B-Instruct",
-        r"mistral|mixtral": "mistralai/Mistral-Nemo-Instruct-2407",
-        r"gemma":          "google/gemma-3-1b-it"
-    }
-
+    # Ungated mirrors are preferred so no HF_TOKEN is required. Patterns are
+    # compiled once, case-insensitively.
+    _TOKENIZER_MAP: tuple[tuple[re.Pattern[str], str], ...] = tuple(
+        (re.compile(pattern, re.IGNORECASE), hf_id)
+        for pattern, hf_id in {
+            r"llama":           "unsloth/Llama-3.2-1B-Instruct",
+            r"mistral|mixtral": "mistralai/Mistral-Nemo-Instruct-2407",
+            r"gemma":           "google/gemma-3-1b-it",
+        }.items()
+    )
 
     # Cache loaded tokenizers so each is only downloaded/initialised once.
     _tokenizer_cache: dict[str, AutoTokenizer] = {}
 
+    # Template files are immutable per process; cache contents by path.
+    _contents_cache: dict[str, str] = {}
+
+    # Rendered chat prompts keyed by (tokenizer id, template path). Models
+    # sharing a tokenizer share the rendered prompt.
+    _chat_prompt_cache: dict[tuple[str, str], str] = {}
+
     def __init__(self) -> None:
         
         """Deny instantiation of class."""
@@ -71,6 +82,9 @@ class ReadTemplate:
         The `---` separator is optional: if absent the entire file is treated
         as the system message with no separate user turn.
 
+        The rendered string is cached per tokenizer and template, so only the
+        first call for a given pair reads the file and runs Jinja2.
+
         Args:
             model (str): The model identifier (e.g. `"llama3.2"`).
             template (Template): Template enum selecting the `.txt` file.
@@ -79,6 +93,11 @@ class ReadTemplate:
             str: Fully formatted prompt string with model-specific tokens,
                 ready to be passed to `PromptTemplate`.
         """
+        hf_id = self.__match_tokenizer_id(model)
+        cache_key = (hf_id, template.path)
+        if cache_key in self._chat_prompt_cache:
+            return self._chat_prompt_cache[cache_key]
+
         raw = self.__get_contents(template)
         parts = raw.split("---", 1)
 
@@ -90,9 +109,11 @@ class ReadTemplate:
             messages.append({"role": "user", "content": user_content})
 
         tokenizer = self.__get_tokenizer(model)
-        return tokenizer.apply_chat_template(
+        prompt = tokenizer.apply_chat_template(
             messages, tokenize=False, add_generation_prompt=True
         )
+        self._chat_prompt_cache[cache_key] = prompt
+        return prompt
 
     def __get_contents(self, template: Template) -> str:
         """Private method to get contents of template file.
@@ -103,31 +124,76 @@ class ReadTemplate:
         Returns:
             str: Contents of template file.
         """
-        output = []
-        with open(template.path, 'r') as reader:
-            output.extend(reader.readlines())
-        return "".join(output)
+        path = template.path
+        if path not in self._contents_cache:
+            with open(path, 'r', encoding='utf-8') as reader:
+                self._contents_cache[path] = reader.read()
+        return self._contents_cache[path]
 
-    def __get_tokenizer(self, model: str) -> AutoTokenizer:
-        """Resolve and cache the HuggingFace tokenizer for *model*.
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def __match_tokenizer_id(model: str) -> str:
+        """Return the HuggingFace tokenizer ID mapped to *model*.
+
+        Results are memoised in a bounded LRU, since *model* may come
+        unvalidated from API clients.
 
         Args:
             model (str): Model identifier string (case-insensitive match).
 
         Returns:
-            AutoTokenizer: Loaded tokenizer for the matched model family.
+            str: HuggingFace tokenizer ID for the matched model family.
 
         Raises:
             ValueError: If no tokenizer mapping exists for *model*.
         """
-        model_lower = model.lower()
-        for pattern, hf_id in self._TOKENIZER_MAP.items():
-            if re.search(pattern, model_lower):
-                if hf_id not in self._tokenizer_cache:
-                    token = os.getenv("HF_TOKEN")
-                    self._tokenizer_cache[hf_id] = AutoTokenizer.from_pretrained(hf_id, token=token)
-                return self._tokenizer_cache[hf_id]
+        for pattern, hf_id in ReadTemplate._TOKENIZER_MAP:
+            if pattern.search(model):
+                return hf_id
         raise ValueError(
             f"No tokenizer mapping found for model '{model}'. "
             f"Add an entry to ReadTemplate._TOKENIZER_MAP."
         )
+
+    def __get_tokenizer(self, model: str) -> AutoTokenizer:
+        """Resolve and cache the HuggingFace tokenizer for *model*.
+
+        Args:
+            model (str): Model identifier string (case-insensitive match).
+
+        Returns:
+            AutoTokenizer: Loaded tokenizer for the matched model family.
+
+        Raises:
+            ValueError: If no tokenizer mapping exists for *model*.
+        """
+        hf_id = self.__match_tokenizer_id(model)
+        if hf_id not in self._tokenizer_cache:
+            self._tokenizer_cache[hf_id] = self.__load_tokenizer(hf_id)
+        return self._tokenizer_cache[hf_id]
+
+    @staticmethod
+    def __load_tokenizer(hf_id: str) -> AutoTokenizer:
+        """Load the fast tokenizer for *hf_id*, preferring the local cache.
+
+        The HuggingFace cache is tried first with `local_files_only=True` so
+        a warm cache (e.g. baked into a Docker layer) never touches the
+        network; on a miss the tokenizer is downloaded.
+
+        Args:
+            hf_id (str): HuggingFace tokenizer ID.
+
+        Returns:
+            AutoTokenizer: Loaded tokenizer.
+        """
+        os.makedirs(
+            os.path.expanduser(os.getenv("HF_HOME", "~/.cache/huggingface")),
+            exist_ok=True,
+        )
+        token = os.getenv("HF_TOKEN")
+        try:
+            return AutoTokenizer.from_pretrained(
+                hf_id, use_fast=True, local_files_only=True, token=token
+            )
+        except OSError:
+            return AutoTokenizer.from_pretrained(hf_id, use_fast=True, token=token)
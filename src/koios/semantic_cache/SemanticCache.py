@@ -0,0 +1,201 @@
+"""SemanticCache.py
+
+In-process semantic cache that returns a stored value when a new query
+embedding is close enough (cosine similarity) to one seen before.
+
+Used in front of the router and generate chains so that paraphrases of a
+recent question skip a full LLM round-trip.
+
+Author: Jared Paubel jpaubel@pm.me
+version 0.1.0
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+import numpy as np
+
+
+def top_k_inner_product(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    """Return the row indices of the *k* largest inner products, best first.
+
+    Uses a partial sort (`argpartition`) so only the top *k* scores are
+    ordered rather than the whole candidate pool.
+
+    Args:
+        matrix (np.ndarray): (N, D) float32 matrix of normalised vectors.
+        query (np.ndarray): (D,) float32 normalised query vector.
+        k (int): Number of indices to return.
+
+    Returns:
+        np.ndarray: Up to *k* row indices ordered by descending score.
+    """
+    scores = matrix @ query
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k == 1:
+        return np.array([int(np.argmax(scores))], dtype=np.intp)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+@dataclass
+class _CacheEntry:
+    row: int
+    key: str
+    value: Any
+    expires_at: float
+
+
+class SemanticCache:
+    """Similarity-keyed LRU cache with TTL eviction.
+
+    Entries are stored with a normalised embedding and an exact-match `key`
+    (e.g. a hash of the model name or of the surrounding context). A lookup
+    only considers entries with the same `key` and returns the value of the
+    most similar embedding if its cosine similarity reaches the threshold.
+
+    Embeddings live in one contiguous float32 matrix (grown by doubling), so
+    a lookup is a single matrix-vector product instead of restacking every
+    stored vector.
+
+    Usage::
+
+        cache = SemanticCache(threshold=0.92)
+        cache.put(embedding, "doc_search", key="llama3.2")
+        cache.get(other_embedding, key="llama3.2")  # "doc_search" if similar
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        maxsize: int = 256,
+        ttl: float = 300.0,
+        update_threshold: float = 0.95,
+    ) -> None:
+        """Construct a SemanticCache.
+
+        Args:
+            threshold (float): Minimum cosine similarity for a cache hit.
+            maxsize (int): Maximum number of entries before LRU eviction.
+            ttl (float): Seconds an entry stays valid.
+            update_threshold (float): Similarity above which `put` replaces an
+                existing entry instead of appending a near-duplicate.
+        """
+        self._threshold = threshold
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._update_threshold = update_threshold
+        self._entries: OrderedDict[int, _CacheEntry] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        # Row i of `_matrix` belongs to entry `_row_ids[i]` with key
+        # `_row_keys[i]`; only the first `len(_row_ids)` rows are live.
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: Optional[np.ndarray] = None
+        self._row_ids: list[int] = []
+
+    @staticmethod
+    def _normalise(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _append_row(self, vector: np.ndarray, key: str, entry_id: int) -> int:
+        """Copy *vector* into the next free matrix row, growing if needed."""
+        size = len(self._row_ids)
+        if self._matrix is None:
+            capacity = min(16, self._maxsize + 1)
+            self._matrix = np.empty((capacity, vector.shape[0]), dtype=np.float32)
+            self._row_keys = np.empty(capacity, dtype=object)
+        elif size == self._matrix.shape[0]:
+            capacity = size * 2
+            self._matrix = np.resize(self._matrix, (capacity, self._matrix.shape[1]))
+            self._row_keys = np.resize(self._row_keys, capacity)
+        self._matrix[size] = vector
+        self._row_keys[size] = key
+        self._row_ids.append(entry_id)
+        return size
+
+    def _remove(self, entry_id: int) -> None:
+        """Drop an entry, moving the last matrix row into its slot."""
+        row = self._entries.pop(entry_id).row
+        last = len(self._row_ids) - 1
+        if row != last:
+            self._matrix[row] = self._matrix[last]
+            self._row_keys[row] = self._row_keys[last]
+            moved_id = self._row_ids[last]
+            self._row_ids[row] = moved_id
+            self._entries[moved_id].row = row
+        self._row_keys[last] = None
+        self._row_ids.pop()
+
+    def _best_match(self, vector: np.ndarray, key: str) -> tuple[Optional[int], float]:
+        """Return the id and similarity of the closest live entry for *key*."""
+        now = time.monotonic()
+        expired = [i for i, e in self._entries.items() if e.expires_at <= now]
+        for entry_id in expired:
+            self._remove(entry_id)
+
+        size = len(self._row_ids)
+        if not size:
+            return None, 0.0
+        rows = np.flatnonzero(self._row_keys[:size] == key)
+        if not rows.size:
+            return None, 0.0
+
+        candidates = self._matrix[rows]
+        best = top_k_inner_product(candidates, vector, 1)[0]
+        row = int(rows[best])
+        return self._row_ids[row], float(candidates[best] @ vector)
+
+    def get(self, embedding: Sequence[float], key: str = "") -> Optional[Any]:
+        """Return the cached value for a similar embedding, if any.
+
+        Args:
+            embedding (Sequence[float]): Query embedding.
+            key (str): Exact-match partition key.
+
+        Returns:
+            Optional[Any]: Cached value on a hit, otherwise None.
+        """
+        vector = self._normalise(embedding)
+        with self._lock:
+            entry_id, score = self._best_match(vector, key)
+            if entry_id is None or score < self._threshold:
+                return None
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id].value
+
+    def put(self, embedding: Sequence[float], value: Any, key: str = "") -> None:
+        """Store *value* under *embedding*.
+
+        Args:
+            embedding (Sequence[float]): Query embedding.
+            value (Any): Value to cache.
+            key (str): Exact-match partition key.
+        """
+        vector = self._normalise(embedding)
+        expires_at = time.monotonic() + self._ttl
+        with self._lock:
+            entry_id, score = self._best_match(vector, key)
+            if entry_id is not None and score >= self._update_threshold:
+                # Near-duplicate: refresh in place rather than append.
+                entry = self._entries[entry_id]
+                self._matrix[entry.row] = vector
+                entry.value = value
+                entry.expires_at = expires_at
+                self._entries.move_to_end(entry_id)
+                return
+
+            entry_id = self._next_id
+            self._next_id += 1
+            row = self._append_row(vector, key, entry_id)
+            self._entries[entry_id] = _CacheEntry(row, key, value, expires_at)
+            while len(self._entries) > self._maxsize:
+                self._remove(next(iter(self._entries)))
@@ -0,0 +1,8 @@
+"""SemanticCache package level init file.
+
+Author: Jared Paubel jpaubel@pm.me
+Version: 0.1.0
+"""
+from src.koios.semantic_cache.SemanticCache import SemanticCache
+
+__all__ = ["SemanticCache"]
@@ -14,7 +14,11 @@ version 0.1.0
 """
 from __future__ import annotations
 
-from typing import Any
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
 
 from toon_format import encode, EncodeOptions
 from src.config import logger
@@ -24,7 +28,8 @@ class ToonSerializer:
     """Encode Python objects to TOON format for token-efficient LLM context.
 
     Wraps the official `toon_format` package and provides a stable,
-    project-level API with graceful fallback to plain-text on failure.
+    project-level API. `encode` raises on failure; `encode_safe` falls back
+    to plain text.
 
     Usage::
 
@@ -36,6 +41,14 @@ class ToonSerializer:
         toon_str = ToonSerializer.dumps(data)
     """
 
+    # Encoded strings shared by all instances, keyed by a digest of the
+    # options and the JSON of the value. Retrieval often returns
+    # the same top-k documents across turns, so repeat payloads skip the
+    # encoder.
+    _CACHE_MAXSIZE = 128
+    _cache: OrderedDict[bytes, str] = OrderedDict()
+    _cache_lock = threading.Lock()
+
     def __init__(self, indent: int = 2, delimiter: str = ",") -> None:
         """Construct a ToonSerializer.
 
@@ -52,33 +65,101 @@ class ToonSerializer:
     def encode(self, value: Any) -> str:
         """Encode *value* to a TOON-formatted string.
 
-        Falls back to `str(value)` if encoding fails so that the calling
-        workflow is never interrupted by a serialisation error.
-
         Args:
             value: Any JSON-serialisable Python object (dict, list, str,
                 int, float, bool, None).
 
+        Returns:
+            str: TOON-encoded representation of *value*.
+
+        Raises:
+            Exception: Whatever `toon_format.encode` raises for *value*.
+        """
+        key = self.__cache_key(value)
+        if key is not None:
+            with ToonSerializer._cache_lock:
+                cached = ToonSerializer._cache.get(key)
+                if cached is not None:
+                    ToonSerializer._cache.move_to_end(key)
+                    return cached
+
+        result = encode(value, self._options)
+
+        if key is not None:
+            with ToonSerializer._cache_lock:
+                ToonSerializer._cache[key] = result
+                if len(ToonSerializer._cache) > ToonSerializer._CACHE_MAXSIZE:
+                    ToonSerializer._cache.popitem(last=False)
+        return result
+
+    def encode_safe(self, value: Any) -> str:
+        """Encode *value* like `encode`, falling back to `str(value)`.
+
+        Used where the calling workflow must never be interrupted by a
+        serialisation error.
+
+        Args:
+            value: Any JSON-serialisable Python object.
+
         Returns:
             str: TOON-encoded representation of *value*, or the plain-text
                 fallback on error.
         """
         try:
-            return encode(value, self._options)
+            return self.encode(value)
         except Exception as exc:  # pragma: no cover
-            logger.error(f"[ToonSerializer] Encoding failed, falling back to str: {exc}")
+            logger.warning("[ToonSerializer] Encoding failed, falling back to str: %s", exc)
             return str(value)
 
+    def __cache_key(self, value: Any) -> Optional[bytes]:
+        """Return a stable digest of *value* and the encode options.
+
+        Keys are not sorted: TOON preserves dict key order, so values that
+        differ only in key order must not share an entry.
+
+        Args:
+            value: Object about to be encoded.
+
+        Returns:
+            Optional[bytes]: Cache key, or None if *value* is not plain JSON
+                (it is then encoded without caching, rather than risking a
+                collision through its `str()` form).
+        """
+        try:
+            serialised = json.dumps([self._options, value])
+        except (TypeError, ValueError):
+            return None
+        return hashlib.blake2b(serialised.encode("utf-8"), digest_size=16).digest()
+
     @classmethod
-    def dumps(cls, value: Any, indent: int = 2, delimiter: str = ",") -> str:
+    def dumps(
+        cls,
+        value: Any,
+        indent: int = 2,
+        delimiter: str = ",",
+        safe: bool = True,
+        min_chars: int = 0,
+    ) -> str:
         """Convenience class-method: encode *value* and return the TOON string.
 
         Args:
             value: Python object to encode.
             indent (int): Spaces per indentation level.
             delimiter (str): Field delimiter.
+            safe (bool): Fall back to `str(value)` instead of raising when
+                encoding fails. Default True.
+            min_chars (int): If the compact JSON form of *value* is shorter
+                than this, return it instead of TOON. Default 0 (always TOON).
 
         Returns:
-            str: TOON-encoded string.
+            str: TOON-encoded string, or compact JSON for small payloads.
         """
-        return cls(indent=indent, delimiter=delimiter).encode(value)
+        if min_chars > 0:
+            try:
+                compact = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+            except (TypeError, ValueError):
+                compact = None
+            if compact is not None and len(compact) < min_chars:
+                return compact
+        serializer = cls(indent=indent, delimiter=delimiter)
+        return serializer.encode_safe(value) if safe else serializer.encode(value)
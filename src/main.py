@@ -5,7 +5,9 @@ Main program to run agent workflow.
 Author: Jared Paubel jpaubel@pm.me
 version 0.1.0
 """
-from src.koios.agent import Workflow, Prompt
+from pathlib import Path
+
+from src.koios.agent import get_workflow, Prompt
 from src.config import config, logger
 
 
@@ -56,8 +58,8 @@ class Main:
         logger.info(f"Using model: {selected_model} (temp: {temperature})")
         logger.info(f"Internet search enabled: {config.enable_internet_search}")
 
-        workflow = Workflow(selected_model, temperature, enable_internet_search=config.enable_internet_search)
-        output = workflow.local_agent.invoke({"question": question})
+        workflow = get_workflow(selected_model, temperature, enable_internet_search=config.enable_internet_search)
+        output = workflow.run_sync({"question": question})
 
         generation = output.get("generation", "No generation produced.")
         logger.info("\n--- Research Report ---\n%s\n-----------------------", generation)
@@ -72,7 +74,9 @@ class Main:
             output (str): Output to be written to file.
         """
         logger.info("Writing result to file...")
-        writer = open("output.md", 'w')
-        writer.write(output)
-        writer.close()
+        # Write beside the target and rename over it, so output.md is never
+        # left half-written.
+        tmp_path = Path("output.md.tmp")
+        tmp_path.write_text(output, encoding="utf-8")
+        tmp_path.replace("output.md")
         logger.info("Result written to output.md file")
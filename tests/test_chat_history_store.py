@@ -0,0 +1,56 @@
+"""test_chat_history_store.py
+
+Tests for the SQLite-backed ChatHistoryStore.
+
+Author: Jared Paubel jpaubel@pm.me
+version 0.1.0
+"""
+import sqlite3
+from contextlib import closing
+from datetime import timedelta
+
+from src.koios.data_store.ChatHistoryStore import ChatHistoryStore
+
+
+def _freelist_count(db_path: str) -> int:
+    with closing(sqlite3.connect(db_path)) as conn:
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def test_clear_history_reclaims_free_pages(tmp_path):
+    db_path = str(tmp_path / "chat_history.sqlite")
+    store = ChatHistoryStore(db_path)
+    store.add_messages(
+        "alice",
+        [{"role": "user", "content": "x" * 4000} for _ in range(200)],
+    )
+
+    # Delete without maintenance to confirm the freed pages are counted.
+    with store._Session.begin() as session:
+        session.execute(store._q_delete_user, {"user_id": "alice"})
+    freed = _freelist_count(db_path)
+    assert freed > 0
+
+    store.add_messages("alice", [{"role": "user", "content": "hello"}])
+    assert store.clear_history("alice") == 1
+    assert _freelist_count(db_path) < freed
+    assert store.get_history("alice") == []
+
+
+def test_maintenance_expires_idle_prefixed_users(tmp_path):
+    db_path = str(tmp_path / "chat_history.sqlite")
+    store = ChatHistoryStore(
+        db_path, expire_prefix="streamlit:", expire_after=timedelta(hours=1)
+    )
+    for user_id in ("streamlit:idle", "streamlit:active", "streamlit_other", "alice"):
+        store.add_messages(user_id, [{"role": "user", "content": "hello"}])
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute(
+            "UPDATE chat_messages SET created_at = '2000-01-01 00:00:00.000000' "
+            "WHERE user_id IN ('streamlit:idle', 'streamlit_other', 'alice')"
+        )
+
+    store.maintenance()
+
+    assert sorted(store.list_users()) == ["alice", "streamlit:active", "streamlit_other"]
+    assert store.get_history("streamlit:idle") == []